@@ -57,13 +57,26 @@ cornice.service.json_error = dasa_error_handler
 def main(global_config, **settings):
     from restrepo.db import DbRequest  # Avoid circular dependencies
     from restrepo.db.settings import Settings
+    from restrepo.db.archive import archive_registry, ARCHIVE_VERSION_KEY
+    from restrepo.indexes.incremental import LAST_REINDEX_KEY
     engine = engine_from_config(settings, prefix='sqlalchemy.')
     settings['db.session'] = sessionmaker(extension=ZopeTransactionExtension(), bind=engine)
     settings['tm.commit_veto'] = 'restrepo.db.commit_veto'
+    # one pool of http connections to solr for all requests
+    from restrepo.solr import make_session, DEFAULT_POOL_SIZE
+    settings['solr.session'] = make_session(pool_size=int(settings.get('solr.pool_size') or DEFAULT_POOL_SIZE))
+    settings['solr.timeout'] = settings.get('solr.timeout') and float(settings['solr.timeout']) or None
+    settings['solr.commit_within'] = settings.get('solr.commit_within') and int(settings['solr.commit_within']) or None
 
     # get settings stored in db
-    for record in settings['db.session']().query(Settings).all():
+    db = settings['db.session']()
+    for record in db.query(Settings).all():
+        if record.key in (ARCHIVE_VERSION_KEY, LAST_REINDEX_KEY):
+            # these are kept by the application itself, and are not configuration
+            continue
         settings[record.key] = record.value
+    # and keep the archives in memory
+    archive_registry.load(db)
     # need to commit the transaction otherwise the Settings table will remain locked
     import transaction
     transaction.commit()
@@ -77,8 +90,10 @@ def main(global_config, **settings):
     config.add_static_view(name='deform_static', path='deform:static')
     config.add_route('admin_archives', '/admin_archives')
     config.add_route('configuration', '/configuration')
+    config.add_route('cache_stats', '/configuration/cache')
     config.add_route('root', '/')
     config.add_renderer(name='csv', factory='restrepo.browser.scans_csv.CSVRenderer')
+    config.add_subscriber('restrepo.db.log_solr_calls', 'pyramid.events.NewResponse')
 
     config.scan("restrepo.security")
     config.scan("restrepo.browser")
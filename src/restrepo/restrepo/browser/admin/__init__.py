@@ -2,6 +2,8 @@ from pyramid.view import view_config
 from pyramid.renderers import render_to_response
 from pyramid.threadlocal import get_current_registry
 
+from restrepo import thumbnail_cache
+
 
 @view_config(route_name='root', permission='write')
 def list_view(request):
@@ -15,6 +17,24 @@ def admin_archives(request):
     return render_to_response('admin_archives.pt', {}, request=request)
 
 
+@view_config(route_name='cache_stats', permission='write', renderer='json')
+def cache_stats(request):
+    """return usage statistics of the thumbnail cache
+
+    the size of the cache and the number of evicted files are those found by the last eviction;
+    the hits and misses (in 'this_process') are counted by each process separately
+
+    a POST request removes least recently used files if the cache is over its budget
+    """
+    settings = get_current_registry().settings
+    max_size = thumbnail_cache.parse_size(settings.get('thumbnails.cache_max_size'))
+    if request.method == 'POST' and max_size:
+        thumbnail_cache.evict(max_size)
+    result = thumbnail_cache.get_stats()
+    result['max_size'] = max_size
+    return result
+
+
 def _patch_request(request):
     # XXX: nasty emergency hack because I cannot seem to get wsgi.url_scheme to work
     _old = request.static_url
@@ -1,6 +1,5 @@
 import colander
 import deform
-import shutil
 import os
 
 from deform import Form
@@ -10,8 +9,7 @@ from pyramid.threadlocal import get_current_registry
 from pyramid.httpexceptions import HTTPBadRequest
 
 from restrepo.db.settings import Settings
-from restrepo.config import CACHE_SUBDIRECTORY
-from restrepo.storage import real_path
+from restrepo.thumbnails import invalidate_watermark_cache
 
 from restrepo.browser.admin import _patch_request
 
@@ -75,19 +73,14 @@ class ConfigurationViews(object):
             context.db.add(setting)
         setting.value = value
         get_current_registry().settings.update(**{key: value})
+        if key.startswith('watermark'):
+            invalidate_watermark_cache()
 
     @view_config(
         route_name='configuration',
         permission='write',
         renderer='configuration.pt')
     def site_view(self):
-        def refresh_cache():
-            # we simply remove all cached files
-            cache_directory = real_path(CACHE_SUBDIRECTORY)
-            if os.path.exists(cache_directory):
-                for fn in os.listdir(cache_directory):
-                    shutil.rmtree(os.path.join(cache_directory, fn))
-
         schema = Configuration()
         settings = get_current_registry().settings
 
@@ -115,12 +108,10 @@ class ConfigurationViews(object):
             # if the file does not exist, we raise a validation error
             if appstruct['watermark_file'] and not os.path.exists(appstruct['watermark_file']):
                 raise HTTPBadRequest('This file {watermark_file} cannot be found'.format(**appstruct))
-            # if anything has changed, we reset the cache
-            for key in appstruct:
-                if settings.get(key) != appstruct[key]:
-                    refresh_cache()
-                    continue
-
+            # we do not need to clear the cache: the names of cached thumbnails
+            # depend on the watermark settings (cf. restrepo.thumbnails.get_settings_hash),
+            # so thumbnails with the old settings are not used anymore, and will be
+            # removed by the cache eviction
             for key in appstruct:
                 # save the new settings in the database
                 self.set_setting(self.request, key, appstruct[key])
@@ -35,7 +35,7 @@ from restrepo.config import ERRORS
 from restrepo.browser.log import get_user, log_events
 from restrepo.config import SERVICE_ARCHIVE_ITEM, SERVICE_ARCHIVE_COLLECTION
 # from restrepo.utils import now
-from restrepo.db.archive import get_archive, get_archives
+from restrepo.db.archive import get_archives, query_archives, archives_changed
 from restrepo.indexes.ead import get_ead_files
 from restrepo.utils import set_cors
 
@@ -110,7 +110,8 @@ def retrieve_archive(request):
     """retrieve the archive corresponding tot he request"""
     archive_id = request.matchdict.get('archive_id')
     try:
-        archive = get_archive(context=request, archive_id=archive_id)
+        # we may change or delete the archive, so we get it from the database (and not from the registry)
+        archive = request.db.query(Archive).filter(Archive.id == archive_id).one()
         request._dbentity['archive'] = archive
     except NoResultFound:
         request.errors.status = 404
@@ -151,7 +152,7 @@ def does_not_exist(request):
     if request.validated.get('archive') or request.validated.get('institution'):
         new_archive = request.validated['archive'] or request._dbentity['archive'].archive
         new_institution = request.validated['institution'] or request._dbentity['archive'].institution
-        archives = get_archives(request, archive=new_archive, institution=new_institution)
+        archives = query_archives(request, archive=new_archive, institution=new_institution)
         if request._dbentity.get('archive'):
             archives = [a for a in archives if a.id != request._dbentity['archive'].id]
         if archives:
@@ -195,6 +196,7 @@ def service_add_archive(request):
 
     request.db.add(archive)
     request.db.flush()
+    archives_changed(request)
     request._dbentity['archive'] = archive
     user = get_user(request)
     log_events(request.db, user, [{
@@ -261,6 +263,7 @@ def update_archive(request):
 
     for k, v in request.validated.items():
         setattr(archive, k, v)
+    archives_changed(request)
     user = get_user(request)
     log_events(request.db, user, [{
         'object_id': archive.id,
@@ -287,6 +290,7 @@ def delete_archive(request):
     }])
     archive = request._dbentity['archive']
     request.db.delete(archive)
+    archives_changed(request)
     return {'success': True}
 
 config.update_docstrings(locals())
@@ -34,6 +34,8 @@ from restrepo.db import EadFile
 from restrepo.browser import lists
 from restrepo.db.archive import get_archives
 from restrepo.db.eadcomponent import get_archive_file_ids
+from restrepo.db.ead import invalidate_xml_tree
+from restrepo.indexes.lists import store_component_trees, delete_component_trees
 from restrepo import config
 from restrepo.config import ERRORS
 from restrepo.browser.log import get_user, log_events
@@ -245,6 +247,7 @@ def service_add_ead_file(request):
     components = eadfile.extract_component_dicts()
     context.solr_eadcomponent.update(components)
     context.solr.commit()
+    store_component_trees(eadfile.name, components)
 
     archivefiles = [cast_component_as_archivefile(x).get_solr_data(context) for x in components if x['is_archiveFile']]
     for archivefile in archivefiles:
@@ -294,14 +297,7 @@ def search_ead_files(request):
     # TODO: EAD file should also return "number_of_scans")
 
     results = indexes.ead.get_ead_files(request, **request.validated)
-    # XXX this is not good: we are searching for data stored in solr.
-    # When data comes out we instantiate the original object
-    # and call expensive methods on it.
-    # (but given that we expect max < 100 files, it is not too serious)
-    # TODO: tune solr stored fields so that results is good to be fed
-    # as a response
-    results = [EadFile(context=request, **ead).to_dict(request)
-        for ead in results]
+    results = [indexes.ead.ead_solr_to_json(request, ead) for ead in results]
 
     return {
         'results': results,
@@ -403,6 +399,7 @@ def update_ead_file(request):
     path=eadfile.get_file_path()
     if 'raw_file' in request.validated:
         store_file(path, request.validated['raw_file'])
+        invalidate_xml_tree(ead_id)
     if 'status' in request.POST:
         eadfile.status=request.validated['status']
     user=get_user(request)
@@ -420,6 +417,7 @@ def update_ead_file(request):
     components = eadfile.extract_component_dicts()
     request.solr_eadcomponent.update(components)
     request.solr.commit()
+    store_component_trees(ead_id, components)
 
     # archivefiles that are already indexed
     indexed_archivefiles = request.solr_archivefile.search(q='ead_ids:' + eadfile.name).documents
@@ -471,6 +469,8 @@ def delete_ead_file(request):
     }])
     ead = request._dbentity['ead']
     delete_file(ead.get_file_path())
+    invalidate_xml_tree(ead.name)
+    delete_component_trees(ead.name)
     request.db.delete(ead)
     request.solr_ead.delete_by_key(ead.name)
     request.solr_eadcomponent.delete_by_query('ead_id:' + ead.name)
@@ -10,6 +10,8 @@
 
 
 """
+import json
+import hashlib
 from cornice import Service
 from restrepo import config
 from restrepo.models.lists import ComponentTreeSearchSchema
@@ -18,7 +20,7 @@ from restrepo.utils import set_cors
 from restrepo.browser.validation import validate_schema, must_have_ead_id_or_archive_id
 from restrepo.browser import validation
 from restrepo.indexes.lists import search_components as _search_components
-from restrepo.indexes.lists import get_tree as _get_tree
+from restrepo.indexes.lists import get_stored_tree as _get_stored_tree
 from restrepo.indexes.archivefile import get_archivefiles
 
 
@@ -260,10 +262,15 @@ def component_tree(request):
     """
     ead_id = request.validated['ead_id']
     prune = request.validated['prune']
-    results = _get_tree(context=request, ead_id=ead_id, prune_tree=prune)
+    # the tree is computed when the ead file is indexed
+    data, last_modified = _get_stored_tree(context=request, ead_id=ead_id, prune_tree=prune)
+    if last_modified:
+        request.response.etag = hashlib.md5(data).hexdigest()
+        request.response.last_modified = last_modified
+        request.response.conditional_response = True
 
     return {
-        'results': results,
+        'results': json.loads(data),
         'query_used': {'ead_id': ead_id},
     }
 
@@ -281,13 +288,7 @@ def list_finding_aid(request):
 
     cf. :ref:`TestLists.test_list_findingaid`
     """
-    # TODO: get these data from SOLR facet!
-    result = []
-    for ead_file in indexes.ead.get_ead_files(context=request):
-        result.append(ead_file['findingaid'])
-    result = list(set(result))
-    result.sort()
-    result = [{'id': findingaid_name} for findingaid_name in result]
+    result = [{'id': findingaid_name} for findingaid_name in indexes.ead.get_findingaids(context=request)]
     return {
         'results': result,
         'total_results': len(result),
@@ -18,6 +18,7 @@ import logging
 import types
 from cgi import FieldStorage
 
+from sqlalchemy.orm import subqueryload
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 
 from pyramid.httpexceptions import HTTPNotFound
@@ -38,12 +39,11 @@ from restrepo.config import SERVICE_SCAN_IMAGES_COLLECTION, SERVICE_SCAN_IMAGES_
 from restrepo.config import SERVICE_SCAN_ITEM_DEFAULT_IMAGE
 from restrepo.config import update_docstrings
 from restrepo.db.scans import collapse_images_array
-from restrepo.db.archive import get_archive
+from restrepo.db.archive import get_archive, get_archives_dict
 from restrepo.db.scan_images import ScanImage
 from restrepo.db.archivefile import sort_field
 from restrepo.config import ERRORS
 from restrepo.db.solr import build_equality_query
-from restrepo.db.solr import SolrException
 from restrepo.indexes.lists import search_components
 from restrepo.indexes.archivefile import search_archivefiles
 from restrepo.indexes.archivefile import cast_scan_as_archivefile
@@ -52,7 +52,9 @@ from restrepo.indexes.archivefile import get_archivefile
 from restrepo.indexes.archivefile import cast_archivefile_as_component
 from restrepo.utils import set_cors
 from restrepo import pagebrowser
+from restrepo import celery_tasks
 from restrepo.db.archivefile import ArchiveFile
+from restrepo.thumbnails import get_pregenerated_sizes, get_watermark_settings
 
 log = logging.getLogger(__name__)
 
@@ -61,6 +63,9 @@ SUPPORTED_IMAGE_FORMATS = (
     'image/jpeg', 'image/tiff', 'image/x-png', 'image/gif'
 )
 
+# the number of bytes we read to determine the type of an uploaded file
+FILETYPE_SNIFF_SIZE = 8192
+
 
 def archive_condition(archive_id, archiveFile):
     "return sqlalchemy condition that selects scans belonging to this archive"
@@ -83,7 +88,8 @@ def valid_scan_file(request):
                 'body', ERRORS.missing_file.name,
                 "The file parameter doesn't contain a file")
             return
-        filetype = whatis(request.POST['file'].file.read())
+        # we only need the first bytes to recognize the file type
+        filetype = whatis(request.POST['file'].file.read(FILETYPE_SNIFF_SIZE))
         request.POST['file'].file.seek(0)
         if filetype not in SUPPORTED_IMAGE_FORMATS:
             request.errors.add(
@@ -242,8 +248,32 @@ def add_scan(request):
     request.solr_scan.update([scandata])
 
     # we need to update the corresponding archive file
+    document = update_archivefile_for_added_scans(request, scandata, 1)
+
+    for ead_id in document['ead_ids']:
+        pagebrowser.update.refresh_book(request, ead_id=ead_id, archivefile_id=document['archivefile_id'])
+
+    # TODO: refactor: WHY IS THIS NEEDED HERE???
+    try:
+        # using request.db.commit on a running server throws an error
+        # but in tests we seem to need it.
+        request.db.commit()
+    except:
+        pass
+    return desolarize(scandata, request)
+
+
+def update_archivefile_for_added_scans(request, scandata, number_of_added_scans):
+    """update the index of the archive file (and its component) to which new scans were added
+
+    scandata is the solr data of one of the added scans.
+    The new scans are not yet committed to the index, so we add number_of_added_scans to
+    the number of scans that the index finds.
+
+    returns the solr data of the archive file
+    """
     document = cast_scan_as_archivefile(request, scandata).get_solr_data(request)
-    document['number_of_scans'] = document['number_of_scans'] + 1
+    document['number_of_scans'] = document['number_of_scans'] + number_of_added_scans
 
     def partial_update_keys(document):
         del document['title']
@@ -260,27 +290,8 @@ def add_scan(request):
 
     component = cast_archivefile_as_component(request, document)
     if component:
-        try:
-            request.solr_eadcomponent.update([component])
-        except SolrException as error:
-            if error.message['responseHeader']['status'] == 409:
-                # this probably is a version conflict error [???]
-                component['_version_'] = 0
-                request.solr_eadcomponent.update([component])
-            else:
-                raise
-
-    for ead_id in document['ead_ids']:
-        pagebrowser.update.refresh_book(request, ead_id=ead_id, archivefile_id=document['archivefile_id'])
-
-    # TODO: refactor: WHY IS THIS NEEDED HERE???
-    try:
-        # using request.db.commit on a running server throws an error
-        # but in tests we seem to need it.
-        request.db.commit()
-    except:
-        pass
-    return desolarize(scandata, request)
+        request.solr_eadcomponent.update([component])
+    return document
 
 
 def add_files_from_request(request, scan, is_default=False):
@@ -294,11 +305,29 @@ def add_files_from_request(request, scan, is_default=False):
         scan.images.append(image)
         added_images.append(image)
         request.db.flush()
-        scan.store_file(fileobj.file.read(), image.id)
+        scan.store_file(fileobj.file, image.id)
         is_default = False  # only the first image can be teh default image
+    pregenerate_thumbnails(request, scan, added_images)
     return added_images
 
 
+def pregenerate_thumbnails(context, scan, images):
+    """render the standard sizes of these images in the background
+
+    the sizes are configured in the `thumbnails.pregenerate_sizes` setting.
+    Sizes that are not pregenerated are rendered on demand (cf. Scan.get_thumbnail_path)
+    """
+    settings = context.registry.settings
+    sizes = get_pregenerated_sizes(settings)
+    if not sizes:
+        return
+    watermark_settings = get_watermark_settings(settings)
+    for image in images:
+        thumbnails = scan.get_pregenerated_thumbnails(image.id, sizes, watermark_settings)
+        if thumbnails:
+            celery_tasks.generate_thumbnails.delay(scan.get_real_path(image.id), thumbnails, watermark_settings)
+
+
 def valid_search_data(request):
     get_as_dict = request.GET.copy().mixed()
 
@@ -460,20 +489,32 @@ def delete_scans(request):
     if not archivefile:
         return {'success': True}
 
-    scans = request.db.query(Scan)
-    scans = scans.filter(Scan.archive_id == archive_id)
-    scans = scans.filter(Scan.archiveFile == archiveFile)
-    scans = scans.order_by(Scan.sequenceNumber.desc())  # order descendingly, so reordering scans takes little time
-    scans = scans.all()
+    scans = request.db.query(Scan).filter(archive_condition(archive_id, archiveFile))
+    scans = scans.options(subqueryload('images')).all()
 
     if not scans:
         return {'success': True}
 
-    # TODO: optimize: we also dont need to reorder, because we drop all scans of the archivefile
+    # we remove all scans of the archivefile, so we do not need to renumber the remaining ones
+    # (as delete_scan does), and we can remove the scans with a few set-based operations
     context = request
+    numbers = [scan.number for scan in scans]
+    for scan in scans:
+        scan.delete_files()
+    request.db.query(ScanImage).filter(ScanImage.scan_number.in_(numbers)).delete(synchronize_session=False)
+    request.db.query(Scan).filter(Scan.number.in_(numbers)).delete(synchronize_session=False)
     for scan in scans:
-        user = get_user(request)
-        delete_scan(context=context, scan=scan, user=user, ping_pagebrowser=False, update_archivefile=False)
+        for image in scan.images:
+            request.db.expunge(image)
+        request.db.expunge(scan)
+
+    context.solr_scan.delete_by_query(build_equality_query(archive_id=archive_id, archiveFile=archiveFile))
+
+    user = get_user(request)
+    log_events(request.db, user, [
+        {'message': 'delete', 'object_id': number, 'object_type': 'scan'}
+        for number in numbers
+    ])
 
     archivefile['number_of_scans'] = 0
     archivefile_deleted = delete_orphaned_archivefile(context=request, archivefile=archivefile)
@@ -481,7 +522,7 @@ def delete_scans(request):
         #
         # if we did not delete the archive file, we need to update the index
         #
-        archivefile = cast_scan_as_archivefile(context, scan.get_solr_data()).get_solr_data(context)
+        archivefile = cast_scan_as_archivefile(context, {'archive_id': archive_id, 'archiveFile': archiveFile}).get_solr_data(context)
         archivefile['number_of_scans'] = 0
         context.solr_archivefile.update([archivefile])
         component = cast_archivefile_as_component(context, archivefile)
@@ -498,6 +539,121 @@ def delete_scans(request):
     return {'success': True}
 
 
+service_utils_scan_add = Service(name='service_utils_scan_add', path=config.SERVICE_UTILS_SCAN_ADD, description='Add a batch of scans')
+
+
+def valid_scan_files(request):
+    """check that there is at least one file, and that all files are images"""
+    fileobjs = request.POST.getall('file')
+    if not fileobjs:
+        request.errors.add('body', ERRORS.invalid_file.name, "Missing file")
+        return
+    for fileobj in fileobjs:
+        if not isinstance(fileobj, FieldStorage):
+            request.errors.add(
+                'body', ERRORS.missing_file.name,
+                "The file parameter doesn't contain a file")
+            return
+        filetype = whatis(fileobj.file.read(FILETYPE_SNIFF_SIZE))
+        fileobj.file.seek(0)
+        if filetype not in SUPPORTED_IMAGE_FORMATS:
+            request.errors.add(
+                'body', ERRORS.invalid_file.name,
+                "Unsupported file type: %s" % fileobj.filename)
+
+
+def valid_scans_data_new(request):
+    scan = dict(request.POST)
+    if 'file' in scan:
+        del scan['file']
+    validate_schema(ScanSchema(), scan, request)
+    check_unmutablefields(request)
+    if 'archive_id' in scan:
+        valid_archive_id(scan['archive_id'], request)
+
+
+@service_utils_scan_add.post(
+    validators=[lock_table_scan, valid_scans_data_new, valid_scan_files, no_status0],
+    filters=set_cors,
+    permission='write',
+)
+def add_scans(request):
+    """
+    Add a batch of scans to one archive file: one scan for each file
+
+    The scans get consecutive sequence numbers, after the existing scans of the archive file,
+    in the order in which the files are given.
+
+    parameters:
+        %(PARAM_ARCHIVE_ID)s
+        * **archiveFile:**
+            identifier of an archive file within the archive
+            (given by archive_id)
+        * **file:**
+            the images of the scans (this parameter can be given more than once).
+            Must be TIFF, GIF, PNG or JPEG.
+        * **user:**
+            the name of a user - optional, will be used for logging info
+        :other parameters:
+            all parameters from the data model :ref:`datamodel_scans`, these are
+            set on each of the new scans
+        :returns:
+            a dictionary with the key `results` with information about the scans
+
+    See :ref:`TestAddScans.test_add_scans`
+    """
+    data = prepare_data(request)
+    fileobjs = request.POST.getall('file')
+    sequenceNumber = find_next_sequence_number(request, data['archive_id'], data['archiveFile'])
+    date = now()
+
+    scans = []
+    for i, fileobj in enumerate(fileobjs):
+        scan = Scan()
+        for key in data:
+            setattr(scan, key, data[key])
+        scan.sequenceNumber = sequenceNumber + i
+        if not scan.date:
+            scan.date = date
+        scan.last_modified = date
+        scans.append(scan)
+    request.db.add_all(scans)
+    request.db.flush()
+
+    images = []
+    for scan, fileobj in zip(scans, fileobjs):
+        image = ScanImage(filename=fileobj.filename, scan_number=scan.number, is_default=True)
+        scan.images.append(image)
+        images.append(image)
+    request.db.flush()
+
+    for scan, image, fileobj in zip(scans, images, fileobjs):
+        scan.store_file(fileobj.file, image.id)
+        pregenerate_thumbnails(request, scan, [image])
+
+    user = get_user(request)
+    log_events(request.db, user, [
+        {'message': 'create', 'object_id': scan.number, 'object_type': 'scan'}
+        for scan in scans
+    ])
+
+    archives = get_archives_dict(request)
+    scandatas = [scan.get_solr_data(archives=archives) for scan in scans]
+    request.solr_scan.update(scandatas)
+
+    document = update_archivefile_for_added_scans(request, scandatas[0], len(scans))
+    for ead_id in document['ead_ids']:
+        pagebrowser.update.refresh_book(request, ead_id=ead_id, archivefile_id=document['archivefile_id'])
+
+    try:
+        # cf. add_scan
+        request.db.commit()
+    except:
+        pass
+    results = [desolarize(scandata, request) for scandata in scandatas]
+    return {'results': results, 'total_results': len(results)}
+
+
 def desolarize(doc, request):
     for k in ['text', 'id', 'entity_type']:
         if k in doc:
@@ -620,15 +776,18 @@ def delete_scan(context, scan, user, ping_pagebrowser=True, update_archivefile=T
     #
     cond = Scan.sequenceNumber > scan.sequenceNumber
     cond &= get_archivefile_condition(scan)
-    to_renumber = db.query(Scan).filter(cond)
     # run the query before we actully update
-    to_renumber_all = to_renumber.all()
-    to_renumber.update({Scan.sequenceNumber: Scan.sequenceNumber - 1})
+    to_renumber_all = db.query(Scan.number, Scan.sequenceNumber).filter(cond).all()
+    db.query(Scan).filter(cond).update({Scan.sequenceNumber: Scan.sequenceNumber - 1})
     db.delete(scan)
 
     context.solr_scan.delete_by_key(scan.number)
-    # TODO: optimization: next line is expensive..
-    context.solr_scan.update([el.get_solr_data() for el in to_renumber_all])
+    # only the sequenceNumber has changed, so a (partial) update of that field is enough
+    if to_renumber_all:
+        context.solr_scan.update([
+            {'number': number, 'sequenceNumber': {'set': sequenceNumber - 1}}
+            for number, sequenceNumber in to_renumber_all
+        ])
 
     # delete the archivefile if it has no further references, and if it is not in the db
     if update_archivefile:
@@ -689,12 +848,12 @@ def update_scan_endpoint(request):
     data = prepare_data(request)
     scan = request._dbentity['scan']
     fileobj = request.POST.get('file')
-    filecontents = None
+    uploaded_file = None
     filename = None
     if fileobj is not None:  # fileobj evaluates to False, so no Boolean test
-        filecontents = fileobj.file.read()
+        uploaded_file = fileobj.file
     user = get_user(request)
-    update_scan(request, scan, data, filecontents, filename, user)
+    update_scan(request, scan, data, uploaded_file, filename, user)
     result = scan.to_dict(request, include_images=True)
     logging.debug('End PUT scan request')
     return result
@@ -719,8 +878,10 @@ def update_scan_endpoint_post(request):
     return update_scan_endpoint(request)
 
 
-def update_scan(context, scan, data, filecontents, filename, user=None):
+def update_scan(context, scan, data, uploaded_file, filename, user=None):
     """
+    uploaded_file is a file-like object with a new image (or None)
+
     - update solr data of scan
     - update solr data of archivefile
     - update solr data of eadcomponent
@@ -805,7 +966,7 @@ def update_scan(context, scan, data, filecontents, filename, user=None):
         new_archivefile = cast_scan_as_archivefile(context, {'archive_id': scan.archive_id, 'archiveFile': scan.archiveFile}).get_solr_data(context)
         context.solr_archivefile.update([new_archivefile])
 
-    if filecontents:
+    if uploaded_file is not None:
         # erase other images
         for image in scan.images:
             scan.remove_file(image.id)
@@ -814,7 +975,8 @@ def update_scan(context, scan, data, filecontents, filename, user=None):
         image = ScanImage(filename=filename, scan_number=scan.number, is_default=True)
         scan.images.append(image)
         context.db.flush()
-        scan.store_file(filecontents, image.id)
+        scan.store_file(uploaded_file, image.id)
+        pregenerate_thumbnails(context, scan, [image])
 
     #
     # we need to ping the pagebrowser that the archivefile has changed
@@ -1237,7 +1399,8 @@ def put_scan_image_item(request):
     if 'file' in request.POST:
         scan.delete_files_for_image(scanimage.id)
         scanimage.filename = request.POST['file'].filename
-        scan.store_file(request.POST['file'].file.read(), scanimage.id)
+        scan.store_file(request.POST['file'].file, scanimage.id)
+        pregenerate_thumbnails(request, scan, [scanimage])
 
     # updae the last_modified date of the scan
     scan.last_modified = now()
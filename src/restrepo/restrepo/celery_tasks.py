@@ -7,6 +7,7 @@ from celery import Celery
 from celery import Task
 
 from restrepo import config
+from restrepo.thumbnails import ensure_thumbnail
 
 # dont spoil our log with lots of info about requests handler
 requests_logger = logging.getLogger("requests")
@@ -26,21 +27,27 @@ app.queued_tasks = {}
 QUEUE_TIMEOUT = 20
 
 
-class PingPagebrowserTask(Task):
+class DelayOrLogTask(Task):
+    """a task that logs an error instead of raising it if rabbitmq cannot be reached"""
+
+    def delay(self, *args, **kwargs):
+        try:
+            return super(DelayOrLogTask, self).delay(*args, **kwargs)
+        except Exception as error:
+            if getattr(error.message, 'errno', None) == 111:
+                # [Errno 111] Connection refused
+                msg = unicode(error)
+                msg += ' - Is rabbitmq-server installed and running?'
+                logging.error(msg)
+            else:
+                raise error
+
+
+class PingPagebrowserTask(DelayOrLogTask):
     def delay(self, action, url, ead_id, archivefile_id):
         new_task = self.add_to_queue(action, url, ead_id, archivefile_id)
         if new_task:
-            try:
-                return super(PingPagebrowserTask, self).delay(action, url, ead_id, archivefile_id)
-            except Exception as error:
-                if error.message.errno == 111:
-                    # [Errno 111] Connection refused
-                    msg = unicode(error)
-                    msg += ' - Is rabbitmq-server installed and running?'
-                    logging.error(msg)
-                    # raise Exception(msg)
-                else:
-                    raise error
+            return super(PingPagebrowserTask, self).delay(action, url, ead_id, archivefile_id)
 
     def after_return(self, status, retval, task_id, args, kwargs, einfo):
         action, url, ead_id, archivefile_id = args
@@ -117,3 +124,24 @@ def update_book(self, action, url, ead_id, archivefile_id):
     else:
         msg = '[{now}] Failure: {action} book at {archivefile_id} {ead_id} using {url} and {params}.\n{response.content}'.format(**locals())
         raise Exception(msg)
+
+
+@app.task(base=DelayOrLogTask, name='Generate Thumbnails')
+def generate_thumbnails(original_path, thumbnails, settings):
+    """render resized versions of the image at original_path
+
+    thumbnails is a list of (size, thumbnail_path) pairs
+    settings is a dictionary with the watermark settings
+
+    sizes that have been rendered in the meantime (for example, on demand) are skipped
+    """
+    rendered = []
+    for size, thumbnail_path in thumbnails:
+        if os.path.exists(thumbnail_path):
+            continue
+        if not os.path.exists(original_path):
+            # the image was deleted before we got to it
+            break
+        ensure_thumbnail(original_path, thumbnail_path, size, settings)
+        rendered.append(thumbnail_path)
+    return rendered
@@ -17,6 +17,8 @@ ARCHIVE_IDS = ('archive_id', 'archiveFile')  # these two items together identify
 
 # subdirectory of the images loction, where cached thumbnails are stored
 CACHE_SUBDIRECTORY = 'cache'
+# subdirectory of the repository, where the component trees of the ead files are stored
+COMPONENT_TREE_SUBDIRECTORY = 'component_trees'
 SERVICE_SCAN_COLLECTION = '/scans'
 SERVICE_SCAN_COLLECTION_CSV = '/scans.csv'
 SERVICE_SCAN_ITEM = '/scans/{number}'
@@ -40,6 +42,7 @@ SERVICE_FINDINGAID_COLLECTION = '/lists/findingaid'
 SERVICE_PAGEBROWSER_BOOK = '/pagebrowser/{archive_id}/{archiveFile}'
 SERVICE_PAGEBROWSER_PAGELIST = SERVICE_PAGEBROWSER_BOOK + '/pagelist'
 SERVICE_UTILS_SCAN_DELETE = '/utils/delete_scans'
+SERVICE_UTILS_SCAN_ADD = '/utils/add_scans'
 SERVICE_ERROR = '/error'
 
 # next one is deprecated
@@ -15,6 +15,8 @@ from pytz import UTC
 import logging
 from ..config import OPTIMIZATION_SOFT_COMMIT
 
+logger = logging.getLogger(__name__)
+
 
 class UTCDateTime(types.TypeDecorator):
     impl = types.DateTime
@@ -43,7 +45,16 @@ class DbRequest(Request):
 
     @reify
     def solr(self):
-        return Solr(self.registry.settings['solr.url'] + 'entity')
+        # the http session (with its open connections) is shared by all requests, cf. restrepo.main
+        settings = self.registry.settings
+        return Solr(
+            settings['solr.url'] + 'entity',
+            session=settings.get('solr.session'),
+            timeout=settings.get('solr.timeout'),
+            # the updates are sent at the end of the request, cf. commit_veto
+            buffered=True,
+            commit_within=settings.get('solr.commit_within'),
+        )
 
     @reify
     def solr_scan(self):
@@ -62,14 +73,34 @@ class DbRequest(Request):
         return SolrWrapper(self.solr, 'archivefile', 'archivefile_id')
 
 
+def log_solr_calls(event):
+    """report the number of calls to solr, and the time spent on them, in a Server-Timing header"""
+    request = event.request
+    # request.solr is reified: if it is in the __dict__, it was used in this request
+    solr = request.__dict__.get('solr')
+    if solr is not None and solr.calls:
+        event.response.headers['Server-Timing'] = 'solr;dur=%.1f;desc="%s calls"' % (solr.seconds * 1000, solr.calls)
+        logger.debug('%s %s: %s solr calls in %.3f seconds' % (request.method, request.path, solr.calls, solr.seconds))
+
+
 def commit_veto(request, response):
     # The default vetoes on response status != 2xx
     vetoed = default_commit_veto(request, response)
-    if not vetoed and request.method in ('GET', 'POST', 'PUT', 'DELETE'):
+    # request.solr is reified: if it is not in the __dict__, it was not used in this request
+    solr = request.__dict__.get('solr')
+    if vetoed:
+        # the changes are not saved in the database, so we do not send them to solr either
+        if solr is not None:
+            solr.discard()
+    elif solr is not None and solr.changed:
         # we abuse the commit_veto call (called at the end of each request by
         # the pyramid transaction manager)
-        # to also commit to solr
-        request.solr.commit(soft_commit=OPTIMIZATION_SOFT_COMMIT)
+        # to also send the buffered updates to solr, and commit (if this request changed anything)
+        if solr.commit_within:
+            # solr commits by itself
+            solr.flush()
+        else:
+            solr.commit(soft_commit=OPTIMIZATION_SOFT_COMMIT)
     return vetoed
 
 
@@ -1,7 +1,13 @@
+import time
+import uuid
+import threading
+
+import transaction
 from sqlalchemy import Table, Column, Integer, Text
 from sqlalchemy.orm import mapper
 from restrepo.db import metadata
 from restrepo.db.mixins import DictAble
+from restrepo.db.settings import Settings
 # from restrepo.config import SERVICE_ARCHIVE_ITEM
 
 archive_table = Table('archive', metadata,
@@ -26,14 +32,122 @@ class Archive(DictAble):
 
 mapper(Archive, archive_table)
 
+# the key in the settings table that changes each time an archive is added, changed or deleted
+ARCHIVE_VERSION_KEY = 'archive.version'
+# how often (in seconds) we check if another process changed the archives
+ARCHIVE_REGISTRY_CHECK_INTERVAL = 5
 
-def get_archives(
+
+class ArchiveRegistry(object):
+    """An in-memory copy of the archive table
+
+    The archive table is small and hardly ever changes, so we keep it in memory
+    instead of querying it each time we need an archive.
+
+    Services that change the archive table call `archives_changed`, which
+    stores a new version in the settings table and invalidates the registry
+    of this process when the transaction is committed. Other processes check
+    the version at most every ARCHIVE_REGISTRY_CHECK_INTERVAL seconds, and
+    reload the archives when it changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        # (version, archives, by_id, by_key, by_country)
+        self._data = None
+        self._checked = 0
+
+    def load(self, db):
+        """(re)load the archives from the database"""
+        version = self._get_version(db)
+        archives = [dict(archive) for archive in db.query(Archive).order_by(Archive.id)]
+        by_id = {}
+        by_key = {}
+        by_country = {}
+        for archive in archives:
+            by_id[archive['id']] = archive
+            by_key.setdefault((archive['institution'], archive['archive']), []).append(archive)
+            by_country.setdefault(archive['country_code'], []).append(archive)
+        with self._lock:
+            self._data = (version, archives, by_id, by_key, by_country)
+            self._checked = time.time()
+
+    def _get_version(self, db):
+        setting = db.query(Settings).get(ARCHIVE_VERSION_KEY)
+        return setting and setting.value
+
+    def _get_data(self, db):
+        data = self._data
+        if data is None:
+            self.load(db)
+        elif time.time() - self._checked > ARCHIVE_REGISTRY_CHECK_INTERVAL:
+            if self._get_version(db) != data[0]:
+                self.load(db)
+            else:
+                self._checked = time.time()
+        return self._data
+
+    def get_archives(self, db, institution=None, archive=None, country=None, archive_id=None):
+        """return the data (dictionaries) of the archives that match the arguments, ordered by id"""
+        _version, archives, by_id, by_key, by_country = self._get_data(db)
+        if archive_id:
+            try:
+                archive_id = int(archive_id)
+            except ValueError:
+                return []
+            archives = [by_id[archive_id]] if archive_id in by_id else []
+        elif institution and archive:
+            archives = by_key.get((institution, archive), [])
+        elif country:
+            archives = by_country.get(country, [])
+        if institution:
+            archives = [a for a in archives if a['institution'] == institution]
+        if archive:
+            archives = [a for a in archives if a['archive'] == archive]
+        if country:
+            archives = [a for a in archives if a['country_code'] == country]
+        return archives
+
+
+archive_registry = ArchiveRegistry()
+
+
+def archives_changed(context):
+    """record that the archive table was changed in the current transaction
+
+    Call this from each service that adds, changes or deletes an archive.
+    """
+    setting = context.db.query(Settings).get(ARCHIVE_VERSION_KEY)
+    if not setting:
+        setting = Settings()
+        setting.key = ARCHIVE_VERSION_KEY
+        context.db.add(setting)
+    setting.value = uuid.uuid4().hex
+    transaction.get().addAfterCommitHook(lambda status: archive_registry.invalidate())
+
+
+def _archive_from_dict(data):
+    # a new object on each call, so callers can do what they like with it
+    archive = Archive()
+    for key, value in data.items():
+        setattr(archive, key, value)
+    return archive
+
+
+def query_archives(
     context,
     institution=None,
     archive=None,
     country=None,
     archive_id=None,
 ):
+    """like get_archives, but query the database
+
+    Use this when you need the archives in the session, for example to change them.
+    """
     query = context.db.query(Archive)
     if institution:
         query = query.filter(Archive.institution == institution)
@@ -46,6 +160,37 @@ def get_archives(
     return query.order_by(Archive.id).all()
 
 
+def get_archives(
+    context,
+    institution=None,
+    archive=None,
+    country=None,
+    archive_id=None,
+):
+    """return the archives that match the arguments, ordered by id
+
+    The archives come from the archive registry, and are not in the session
+    (use query_archives to get archives that you want to change)
+    """
+    archives = archive_registry.get_archives(
+        context.db,
+        institution=institution,
+        archive=archive,
+        country=country,
+        archive_id=archive_id,
+    )
+    return [_archive_from_dict(data) for data in archives]
+
+
+def get_archives_dict(context):
+    """return a dictionary {archive_id: archive data} of all archives
+
+    The archive table is small, so this can be used to avoid
+    querying the archive of each scan separately
+    """
+    return dict((data['id'], dict(data)) for data in archive_registry.get_archives(context.db))
+
+
 def get_archive(
     context,
     institution=None,
@@ -56,10 +201,17 @@ def get_archive(
         archives = get_archives(context, archive_id=archive_id)
     else:
         archives = get_archives(context, institution=institution, archive=archive)
+    if not archives:
+        # the archive may have been added by another process since we last
+        # checked the registry (cf. ARCHIVE_REGISTRY_CHECK_INTERVAL)
+        archives = query_archives(context, institution=institution, archive=archive, archive_id=archive_id)
+        if archives:
+            archive_registry.invalidate()
+        archives = [_archive_from_dict(dict(data)) for data in archives]
     params = "with institution='%s' and archive='%s'" % (institution, archive)
     if not archives:
         raise Exception('No archive found: %s' % params)
     if len(archives) > 1:
-        msg = 'More than one archive found' % params
+        msg = 'More than one archive found: %s' % params
         raise Exception(msg)
     return archives[0]
@@ -6,7 +6,6 @@
 #
 
 
-import json
 from sqlalchemy import Table, Column, Unicode, Integer, String
 from sqlalchemy.orm import object_session
 from sqlalchemy.orm.exc import NoResultFound
@@ -46,8 +45,7 @@ class ArchiveFile(JsonSaver, DictAble):
         del me['json_data']
         if not dbdata_only:
             me['URL'] = request.route_url('service_archive_item', **me)
-        if self.json_data:
-            me.update(json.loads(self.json_data))
+        me.update(self._get_json_fields())
         return me
 
     def get_solr_data(self, context):
@@ -189,11 +187,11 @@ def get_archivefiles_query(
         condition = (ArchiveFile.archiveFile == archiveFile) & condition
 
     if archive and institution:
-        archives = get_archives(archive=archive, institution=institution)
+        archives = get_archives(context, archive=archive, institution=institution)
     elif archive:
-        archives = get_archives(archive=archive)
+        archives = get_archives(context, archive=archive)
     elif institution:
-        archives = get_archives(institution=institution)
+        archives = get_archives(context, institution=institution)
     else:
         archives = None
 
@@ -7,6 +7,8 @@
 
 import os
 import csv
+import threading
+from collections import OrderedDict
 from lxml import etree
 
 from sqlalchemy import Table, Column, Integer, String
@@ -14,7 +16,8 @@ from sqlalchemy.orm import mapper
 from restrepo.config import status
 from restrepo.db import metadata, UTCDateTime
 from restrepo.db.archive import get_archives, get_archive
-from restrepo.storage import get_file, store_file
+from restrepo.db.solr import build_equality_query
+from restrepo.storage import real_path, store_file
 from restrepo.utils import datetime_to_string_zulu
 from restrepo.utils import now, string_to_datetime
 from restrepo.config import FN_EAD2VIEWER_MAPPING
@@ -62,6 +65,52 @@ def ead2view():
     return _ead2view
 
 
+# the parsed EAD files, shared between requests
+# the keys are (name, mtime, size) of the file, so a changed file is parsed again
+XML_TREE_CACHE_SIZE = 128 * 1024 * 1024  # the total size (in bytes) of the files we keep parsed
+_xml_tree_cache = OrderedDict()
+_xml_tree_cache_lock = threading.Lock()
+
+
+def get_xml_tree(name, filepath):
+    """return the parsed EAD file `name` stored at filepath
+
+    the least recently used trees are removed from the cache when
+    the files in the cache are larger than XML_TREE_CACHE_SIZE together.
+    The trees are shared: do not change them.
+    """
+    realpath = real_path(filepath, create=False)
+    stat = os.stat(realpath)
+    key = (name, stat.st_mtime, stat.st_size)
+    with _xml_tree_cache_lock:
+        tree = _xml_tree_cache.pop(key, None)
+        if tree is not None:
+            # put it back as most recently used
+            _xml_tree_cache[key] = tree
+            return tree
+    tree = etree.parse(realpath)
+    with _xml_tree_cache_lock:
+        _remove_xml_trees(name)
+        if stat.st_size <= XML_TREE_CACHE_SIZE:
+            _xml_tree_cache[key] = tree
+        total = sum(size for (_name, _mtime, size) in _xml_tree_cache)
+        while total > XML_TREE_CACHE_SIZE:
+            (_name, _mtime, size), _tree = _xml_tree_cache.popitem(last=False)
+            total -= size
+    return tree
+
+
+def _remove_xml_trees(name):
+    for key in [key for key in _xml_tree_cache if key[0] == name]:
+        del _xml_tree_cache[key]
+
+
+def invalidate_xml_tree(name):
+    """remove the parsed EAD file `name` from the cache (call this when the file changes or is deleted)"""
+    with _xml_tree_cache_lock:
+        _remove_xml_trees(name)
+
+
 def add_ead_file(
     context,
     name,
@@ -77,6 +126,7 @@ def add_ead_file(
     eadfile.name = name
     eadfile.status = status
     store_file(eadfile.get_file_path(), filecontents,)
+    invalidate_xml_tree(name)
     context.db.add(eadfile)
     eadfile.last_modified = now()
     return eadfile
@@ -189,7 +239,6 @@ class EadFile(object):
         else:
             me['archive_id'] = None
 
-        me['title'] = self.get_title()
         return me
 
     def get_solr_data(self):
@@ -203,6 +252,7 @@ class EadFile(object):
             'institution': self.get_institution(),
             'language': self.get_language(),
             'status': self.status,
+            'title': self.get_title(),
         }
         return solr_data
 
@@ -210,9 +260,7 @@ class EadFile(object):
         return os.path.sep.join(['ead_files', str(self.name)])
 
     def _get_xml_tree(self):
-        # TODO: OPTIMIZATION: this is expensive: either cache this, or don't call it often (at the moment is is called often)
-        self._tree = etree.parse(get_file(self.get_file_path()))
-        return self._tree
+        return get_xml_tree(self.name, self.get_file_path())
 
     @property
     def _cache(self):
@@ -242,6 +290,8 @@ class EadFile(object):
         """
         from restrepo.db.eadcomponent import EadComponent, EadTextElement
         root = self._get_xml_tree().getroot()
+        # the components read the number of scans and the status of their archive file from here
+        self._archivefile_data = self.get_archivefile_data()
 
         result = []
         #
@@ -283,8 +333,37 @@ class EadFile(object):
             result.append(component)
             prev_component = component
 
+        # the data may change after this, so we do not keep it around
+        self._archivefile_data = None
         return result
 
+    def get_archivefile_data(self):
+        """return a tuple (number_of_scans, statuses) for the archive files of the archive of this EAD file
+
+        number_of_scans is a dictionary {archiveFile: number of scans in the index}
+        statuses is a dictionary {archiveFile: status of the archive file in the database}
+
+        (this takes one solr query and one database query, instead of one of each for every component)
+        """
+        from restrepo.db.archivefile import get_archivefiles
+        archive_id = self._cache['archive_id']
+        response = self._context.solr_scan.search(
+            q=build_equality_query(archive_id=archive_id),
+            rows=0,
+            facet='true',
+            **{
+                'facet.field': 'archiveFile',
+                'facet.limit': -1,
+                'facet.mincount': 1,
+            }
+        )
+        number_of_scans = dict(response.facets['facet_fields']['archiveFile'])
+        statuses = dict(
+            (archivefile.archiveFile, archivefile.status)
+            for archivefile in get_archivefiles(self._context, archive_id=archive_id)
+        )
+        return number_of_scans, statuses
+
     def extract_component_dicts(self):
         """extract component JSON data for indexing"""
         return [component.get_solr_data() for component in self.extract_components()]
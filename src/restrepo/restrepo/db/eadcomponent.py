@@ -181,6 +181,8 @@ class EadComponent(EadTextElement):
         self.next = None
         self.level = self._element.attrib.get('level', None)
         self.prev = prev
+        self._parent = self._find_parent(prev)
+        self.depth = self._parent.depth + 1 if self._parent else 0
         EadTextElement.__init__(
             self,
             title=self.get_title(),
@@ -214,12 +216,38 @@ class EadComponent(EadTextElement):
     def _xpath_contained_in(self, xpath, parent_xpath):
         return xpath.startswith(parent_xpath) and len(parent_xpath) < len(xpath)
 
-    def get_parent(self):
-        node = self.prev
+    def _find_parent(self, prev):
+        """find the parent among prev and its ancestors
+
+        components are created in document order, so prev and its ancestors
+        form the stack of the components that contain this one, or were closed before it.
+        """
+        node = prev
         while node:
             if self._xpath_contained_in(self.xpath, node.xpath):
                 return node
-            node = node.prev
+            node = node.get_parent()
+
+    def get_parent(self):
+        return self._parent
+
+    @property
+    def ancestors(self):
+        """the parent, the parent of the parent, etc"""
+        try:
+            return self._ancestors
+        except AttributeError:
+            self._ancestors = self._parent and [self._parent] + self._parent.ancestors or []
+            return self._ancestors
+
+    @property
+    def breadcrumbs(self):
+        try:
+            return self._breadcrumbs
+        except AttributeError:
+            breadcrumbs = [[x.xpath, x.title] for x in self.ancestors if x.show_in_tree]
+            self._breadcrumbs = unicode(json.dumps(breadcrumbs))
+            return self._breadcrumbs
 
     @property
     def search_source(self):
@@ -336,11 +364,18 @@ class EadComponent(EadTextElement):
     def text_lines(self):
         return [self._element.text or '']
 
+    def _get_archivefile_data(self):
+        """the number of scans and statuses of the archive files, if the ead file has collected them"""
+        return getattr(self._ead_file, '_archivefile_data', None)
+
     def get_number_of_scans(self, context):
         #
         # cf also db.archivefile.ArchiveFile.number_of_scans
         #
-        if self.is_archiveFile:
+        archivefile_data = self._get_archivefile_data()
+        if self.is_archiveFile and archivefile_data:
+            return archivefile_data[0].get(self.archiveFile, 0)
+        elif self.is_archiveFile:
             solr_query = build_equality_query(
                 archiveFile=self.archiveFile,
                 archive_id=self.archive_id,
@@ -351,7 +386,10 @@ class EadComponent(EadTextElement):
             return 0
 
     def get_status(self, context):
-        if self.is_archiveFile:
+        archivefile_data = self._get_archivefile_data()
+        if self.is_archiveFile and archivefile_data:
+            return archivefile_data[1].get(self.archiveFile, config.STATUS_NEW)
+        elif self.is_archiveFile:
             # get the archivefile from the db (this is relatively expensive...)
             archivefile = get_archivefile(context, archive_id=self.archive_id, archiveFile=self.archiveFile)
             if archivefile:
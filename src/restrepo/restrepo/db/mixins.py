@@ -25,29 +25,46 @@ class DictAble(object):
 
 
 class JsonSaver(object):
-    "Save non-column values in the 'json_data' column as JSON"
+    """Save non-column values in the 'json_data' column as JSON
+
+    The json_data column is decoded once (and again only when it is replaced,
+    for example when the object is refreshed from the database), so reading
+    many of these values does not parse the JSON each time.
+    """
     # TOOD: refactor and remove this horrendous, implicitly making stuff untransparent, object
-    # Not as efficient as it should. If we would have had a newer SQLAlchemy we
-    # would have used the `reconstruct_instance` hook and the like
     def _is_json_field(self, name):
         columns = class_mapper(type(self)).columns
         if name.startswith('_') or name in columns:
             return False  # Do not hijack private attribute and defined columns
         return True
 
+    def _get_json_fields(self):
+        """return the values in json_data as a dictionary
+
+        Do not change the dictionary: set the attributes instead
+        """
+        json_data = self.json_data
+        if json_data is not self.__dict__.get('_json_source', ()):
+            # we did not decode this value of json_data yet
+            self.__dict__['_json_fields'] = json.loads(json_data or '{}')
+            self.__dict__['_json_source'] = json_data
+        return self.__dict__['_json_fields']
+
     def __setattr__(self, k, v):
         if self._is_json_field(k):
-            json_data = json.loads(self.json_data or '{}')
-            json_data[k] = v
-            super(JsonSaver, self).__setattr__(
-                'json_data', json.dumps(json_data))
+            json_fields = dict(self._get_json_fields())
+            json_fields[k] = v
+            json_data = json.dumps(json_fields)
+            super(JsonSaver, self).__setattr__('json_data', json_data)
+            self.__dict__['_json_fields'] = json_fields
+            self.__dict__['_json_source'] = json_data
         super(JsonSaver, self).__setattr__(k, v)
 
     def __getattr__(self, k):
         if k.startswith('_'):
             return object.__getattribute__(self, k)
         if self._is_json_field(k):
-            place_to_look = json.loads(self.json_data or '{}')
+            place_to_look = self._get_json_fields()
         else:
             place_to_look = self.__dict__
         try:
@@ -17,19 +17,12 @@ restrepo/files
 
 import os
 import glob
-import json
-import types
-import re
-from PIL import Image
-from StringIO import StringIO
 from sqlalchemy import Table, Column, Unicode, Integer, String
 from sqlalchemy import Date
-from sqlalchemy.orm import object_session
+from sqlalchemy.orm import object_session, subqueryload
 
 from pyramid.threadlocal import get_current_registry
 
-from watermarker import place_watermark
-
 from restrepo.config import status as status_values
 from restrepo.config import CACHE_SUBDIRECTORY
 from restrepo.db import metadata
@@ -37,8 +30,11 @@ from restrepo.db.archive import get_archive
 from restrepo.db.archive import get_archives
 from restrepo.db.mixins import JsonSaver, DictAble
 from restrepo.utils import datetime_to_string_zulu, datetime_to_string
-from restrepo.storage import store_file, real_path
-from restrepo.storage import file_exists, get_file_handle
+from restrepo.storage import store_file, store_fileobj, real_path
+from restrepo.storage import file_exists
+from restrepo import thumbnail_cache
+from restrepo.thumbnails import normalize_size, ensure_thumbnail
+from restrepo.thumbnails import get_watermark_settings, get_settings_hash
 from restrepo.db import UTCDateTime
 
 scan = Table(
@@ -88,15 +84,18 @@ class Scan(JsonSaver, DictAble):
                         )
                     )
                     me['images'].append(imagedict)
-        if self.json_data:
-            me.update(json.loads(self.json_data))
+        me.update(self._get_json_fields())
         # ???
         if 'id' in me:
             del me['id']
         return me
 
     def store_file(self, filecontents, image_id):
-        store_file(self.get_file_path(image_id), filecontents)
+        """store the image; filecontents is either a string or a file-like object"""
+        if hasattr(filecontents, 'read'):
+            store_fileobj(self.get_file_path(image_id), filecontents)
+        else:
+            store_file(self.get_file_path(image_id), filecontents)
 
     def remove_file(self, image_id):
         dirpath = real_path(self._get_thumbnail_dir())
@@ -115,7 +114,10 @@ class Scan(JsonSaver, DictAble):
         if os.path.exists(fp):
             os.remove(fp)
         fp = real_path(self._thumbnail_basepath(id))
-        for fn in glob.glob(fp + '*'):
+        for fn in glob.glob(fp + '-*'):
+            if fn.endswith('.lock'):
+                # the thumbnail is being rendered, the renderer removes the lock file
+                continue
             os.remove(fn)
 
     def _thumbnail_basepath(self, image_id):
@@ -141,6 +143,12 @@ class Scan(JsonSaver, DictAble):
             str(self.number),
         )
 
+    def _thumbnail_path(self, size, image_id, watermark_settings=None):
+        "Return the (relative) path of a resized version of the image - it may not exist"
+        if watermark_settings is None:
+            watermark_settings = get_watermark_settings(get_current_registry().settings)
+        return "%s-%s-%s" % (self._thumbnail_basepath(image_id), size, get_settings_hash(watermark_settings))
+
     def get_thumbnail_path(self, size, image_id):
         """
         Return a path to a resized version of the image identified by image_id
@@ -153,83 +161,49 @@ class Scan(JsonSaver, DictAble):
 
         where INT can be an integer string or an empty string
         """
+        # do not return the original image if size is None, because we need to watermark it
+        size = normalize_size(size)
+        watermark_settings = get_watermark_settings(get_current_registry().settings)
+        thumbnail_path = self._thumbnail_path(size, image_id, watermark_settings)
 
-        if size is None:
-            pass
-            # do not return the original image, because we need to watermark it
-            # return self.get_file_path(image_id)
-        elif re.match('[0-9]+$', size):
-            size = 'x' + size  # is size is simply a giti, it is interpreted max height.
-        elif re.match('([0-9]*)x([0-9]*)$', size) and size != 'x':
-            pass
+        if file_exists(thumbnail_path):
+            thumbnail_cache.record_hit(real_path(thumbnail_path))
         else:
-            raise ValueError("Size must be like 300x200 or x400 or 200x")
-
-        basepath = self._thumbnail_basepath(image_id)
-        thumbnail_path = "%s-%s" % (basepath, size)
-
-        if not file_exists(thumbnail_path):
-            fh = get_file_handle(self.get_file_path(image_id))
-            img = Image.open(fh)
-            if not size:
-                size = '100000x10000'
-            w, h = get_resized_size(size.split('x'), img.size)
-            if w >= img.size[0]:
-                # we asked for an image larger than the original - we return the original instead
-                w, h = img.size
-#                 return self.get_file_path(image_id)
-            img.thumbnail((w, h), Image.ANTIALIAS)
-            thumb_fh = StringIO()
-            if img.mode == "P":
-                img = img.convert("RGB")
-            img.save(thumb_fh, 'JPEG', **img.info)
-            thumb_fh.seek(0)
-
-            # determine if we need to watermark this file
-            settings = get_current_registry().settings
-            if w > 100 and h > 100 and settings.get('watermark_file'):
-                # place a watrmark
-                save_fh = StringIO()
-                watermark_fh = open(settings['watermark_file'])
-                watermark_size_width = settings['watermark_size']
-                pos_x = settings['watermark_pos_x']
-                pos_y = settings['watermark_pos_y']
-                if isinstance(pos_x, types.StringTypes) and pos_x.isdigit():
-                    pos_x = int(pos_x)
-                if isinstance(pos_y, types.StringTypes) and pos_y.isdigit():
-                    pos_y = int(pos_y)
-                image_format = settings['watermark_image_format']
-                place_watermark(
-                    thumb_fh,
-                    save_fh,
-                    watermark_file=watermark_fh,
-                    filetype='img',
-                    watermark_size_width=watermark_size_width,
-                    pos_x=pos_x,
-                    pos_y=pos_y,
-                    image_format=image_format,
-                )
-            else:
-                save_fh = thumb_fh
-
-            store_file(thumbnail_path, save_fh.getvalue())
-            thumb_fh.close()
-            save_fh.close()
-            fh.close()
+            thumbnail_cache.record_miss()
+            ensure_thumbnail(
+                self.get_real_path(image_id),
+                real_path(thumbnail_path),
+                size,
+                watermark_settings,
+            )
 
         return thumbnail_path
 
+    def get_pregenerated_thumbnails(self, image_id, sizes, watermark_settings):
+        """return a list of (size, real_path) pairs of derivatives of this image that do not exist yet"""
+        result = []
+        for size in sizes:
+            thumbnail_path = self._thumbnail_path(size, image_id, watermark_settings)
+            if not file_exists(thumbnail_path):
+                result.append((size, real_path(thumbnail_path)))
+        return result
+
     def get_real_thumbnail_path(self, size, image_id):
         return real_path(self.get_thumbnail_path(size, image_id))
 
-    def get_solr_data(self, partial_update_keys=None):
+    def get_solr_data(self, partial_update_keys=None, archives=None):
         """return a dictionary that can be indexed by solr
 
             partial_update_keys is a list of keys
             if partial_update_keys is given, we compute only values that depend on these keys
             and return a dictionary with all values of the form {'set':value} (which instructs solr to do a partial document update)
             This can be used for optimizing updates
+
+            archives is an (optional) dictionary as returned by get_archives_dict
+            pass it when computing the data of many scans, to avoid a database query for each scan
         """
+        if archives is not None and self.archive_id in archives:
+            self._archive_data = archives[self.archive_id]
 
         def maybe(date):
             if date:
@@ -404,38 +378,31 @@ class Context:
         self.db = db
 
 
-def get_resized_size(newsize, oldsize):
-    """
-    newsize and oldsize are pairs of the form (width, height)
-    Given a target w and h return h, v so that their ratio is the same as
-    oldwidth, oldheight. width and height can be strings (also empty).
-    For example:
-
-    >>> get_resized_size(('100', ''), (1, 1))
-    (100, 100)
-    >>> get_resized_size(('', '100'), (1, 1))
-    (100, 100)
-    >>> get_resized_size(('', '100'), (1, 2))
-    (50, 100)
-    """
-    # If one of the parameters is missing calculate it using the ratio
-    # from old values
-    width, height = newsize
-    oldwidth, oldheight = oldsize
-    oldratio = oldwidth / float(oldheight)
-    if not width:
-        height = int(height)
-        width = height * oldratio
-    elif not height:
-        width = int(width)
-        height = width / oldratio
-    return int(width), int(height)
-
-
 def get_scans(context, **kwargs):
     return get_scans_query(context, **kwargs).all()
 
 
+def iter_scans(context, batch_size=1000, **kwargs):
+    """yield the scans (and their images) that get_scans would return, ordered by number
+
+    the scans are read batch_size at a time (using the number of the last scan
+    of the previous batch). The session only holds weak references to unmodified
+    objects, so we never keep the whole table in memory
+    """
+    last_number = None
+    while True:
+        query = get_scans_query(context, **kwargs)
+        if last_number is not None:
+            query = query.filter(Scan.number > last_number)
+        query = query.options(subqueryload('images')).order_by(Scan.number).limit(batch_size)
+        batch = query.all()
+        if not batch:
+            return
+        for scan in batch:
+            yield scan
+        last_number = batch[-1].number
+
+
 def get_scans_query(
     context,
     archive_id=None,
@@ -464,11 +431,11 @@ def get_scans_query(
         condition = (Scan.archiveFile == archiveFile) & condition
 
     if archive and institution:
-        archives = get_archives(archive=archive, institution=institution)
+        archives = get_archives(context, archive=archive, institution=institution)
     elif archive:
-        archives = get_archives(archive=archive)
+        archives = get_archives(context, archive=archive)
     elif institution:
-        archives = get_archives(institution=institution)
+        archives = get_archives(context, institution=institution)
     else:
         archives = None
 
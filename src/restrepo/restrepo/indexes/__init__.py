@@ -1,22 +1,31 @@
+import time
 import logging
+import itertools
 
-from restrepo.db.scans import get_scans
+from restrepo.db.scans import iter_scans, get_scans_query, Scan
+from restrepo.db.archive import get_archives_dict
 from restrepo.db.ead import get_ead_files
 from restrepo.db.ead import EadFile
 from restrepo.indexes.archivefile import cast_component_as_archivefile, cast_scan_as_archivefile
+from restrepo.indexes.lists import store_component_trees
 from restrepo.db.archivefile import get_archivefiles
 
 logger = logging.getLogger(__name__)
 
 
-def reindex_all(context, delete=True):
+def reindex_all(context, delete=True, store_trees=True):
+    """rebuild the whole index
+
+    if store_trees is false, the stored component trees are not replaced
+    (cf. restrepo.indexes.shadow.store_component_trees_from_index)
+    """
     print 'deleting all'
     if delete:
         context.solr.delete_by_query('*:*')
     print 'reindexing ead files'
     reindex_ead_files(context, delete=delete)
     print 'reindexing components'
-    reindex_components(context, delete=delete)
+    reindex_components(context, delete=delete, store_trees=store_trees)
     print 'reindexing archive files'
     reindex_archivefiles(context, delete=delete)
     print 'reindexing scans files'
@@ -36,22 +45,47 @@ def reindex_ead_files(context, delete=True):
     context.solr_ead.commit()  # soft_commit=False)
 
 
-def reindex_scans(context, delete=True):
-    # reindex scans
+def reindex_scans(context, delete=True, batch_size=1000, commit_interval=None):
+    """reindex all scans
+
+    the scans are read from the database and sent to solr in batches of batch_size
+    we commit to solr after every commit_interval batches (or only at the end if commit_interval is None)
+    """
     logger.debug('deleting existing scans from index')
     if delete:
         context.solr_scan.delete_by_query('*:*')
-    documents = get_scans(context)
-    batch_size = 1000
-    logger.debug('scans to index:', len(documents))
-    for i in range(len(documents) / batch_size + 1):
-        start = i * batch_size
-        end = (i + 1) * batch_size
-        number = len(documents[start:end])
-        logger.debug('indexing scans {start} to {end} ({number} docs)'.format(**locals()))
-        documents_to_index = [scan.get_solr_data() for scan in documents[start:end]]
-        context.solr_scan.update(documents_to_index)
-        context.solr_scan.commit()  # soft_commit=True)
+    archives = get_archives_dict(context)
+    documents = (scan.get_solr_data(archives=archives) for scan in iter_scans(context, batch_size=batch_size))
+    start_time = time.time()
+    total = 0
+    for i, batch in enumerate(_batches(documents, batch_size)):
+        context.solr_scan.update(batch)
+        total += len(batch)
+        if commit_interval and (i + 1) % commit_interval == 0:
+            context.solr_scan.commit()
+        elapsed = time.time() - start_time
+        logger.info('indexed {total} scans in {elapsed:.1f} seconds ({rate:.1f} scans/second)'.format(
+            total=total, elapsed=elapsed, rate=total / (elapsed or 1)))
+    context.solr_scan.commit()  # soft_commit=True)
+    return total
+
+
+def _batches(iterable, batch_size):
+    """yield lists of (at most) batch_size items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_scan_archivefiles(context):
+    """return a list of dictionaries with the (distinct) archive_id and archiveFile of the scans"""
+    query = get_scans_query(context).with_entities(Scan.archive_id, Scan.archiveFile).distinct()
+    return [{'archive_id': archive_id, 'archiveFile': archiveFile} for archive_id, archiveFile in query]
 
 
 def get_ead_components(context, delete=True):
@@ -63,13 +97,18 @@ def get_ead_components(context, delete=True):
     return result
 
 
-def reindex_components(context, delete=True):
+def reindex_components(context, delete=True, store_trees=True):
     # reindex components
     if delete:
         context.solr_eadcomponent.delete_by_query('*:*')
     documents = [component.get_solr_data() for component in get_ead_components(context)]
     context.solr_eadcomponent.update(documents)
     context.solr_eadcomponent.commit()  # soft_commit=True)
+    if not store_trees:
+        return
+    # the components of each ead file are together in the list
+    for ead_id, components in itertools.groupby(documents, key=lambda document: document['ead_id']):
+        store_component_trees(ead_id, list(components))
 
 
 def reindex_archivefiles(context, delete=True):
@@ -87,9 +126,11 @@ def reindex_archivefiles(context, delete=True):
     # get the scans from the database
     logger.debug('collecting data to index...')
     already_indexed = [(x['archive_id'], x['archiveFile']) for x in documents]
-    scans = get_scans(context)
-    scans = [scan for scan in scans if (scan.archive_id, scan.archiveFile) not in already_indexed]
-    documents = [cast_scan_as_archivefile(context, scan.get_solr_data()).get_solr_data(context) for scan in scans]
+    documents = [
+        cast_scan_as_archivefile(context, scandata).get_solr_data(context)
+        for scandata in get_scan_archivefiles(context)
+        if (scandata['archive_id'], scandata['archiveFile']) not in already_indexed
+    ]
     logger.debug('documents to index (from scans) ', len(documents))
     context.solr_archivefile.update(documents)
     context.solr_archivefile.commit()
@@ -116,9 +157,11 @@ def refresh_archivefiles(context, delete=True):
 
     # get the scans from the database
     already_indexed = [(x['archive_id'], x['archiveFile']) for x in documents]
-    scans = get_scans(context)
-    scans = [scan for scan in scans if (scan.archive_id, scan.archiveFile) not in already_indexed]
-    documents = [cast_scan_as_archivefile(context, scan.get_solr_data()).get_solr_data(context) for scan in scans]
+    documents = [
+        cast_scan_as_archivefile(context, scandata).get_solr_data(context)
+        for scandata in get_scan_archivefiles(context)
+        if (scandata['archive_id'], scandata['archiveFile']) not in already_indexed
+    ]
     context.solr_archivefile.update(documents)
     context.solr_archivefile.commit()
 
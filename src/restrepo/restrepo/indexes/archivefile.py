@@ -146,8 +146,11 @@ def cast_archivefile_as_component(context, archivefile):
     if component:
         component = component[0]
         component['breadcrumbs'] = json.dumps(component['breadcrumbs'])
+        # the component replaces the one in the index, even if that one changed in the meantime
+        # (updates are sent to solr at the end of the request, where a version conflict can not be handled anymore)
+        component.pop('_version_', None)
         for k in component:
-            if k in archivefile and k not in ['_version_']:
+            if k in archivefile:
                 component[k] = archivefile[k]
         return component
 
@@ -1,5 +1,3 @@
-
-
 def get_ead_files(context, **kwargs):
     """
     search in the solr index for ead files
@@ -15,3 +13,39 @@ def get_ead_files(context, **kwargs):
             querylist.append('+%s:%s' % (fieldname, value))
     results = context.solr_ead.search(q=' '.join(querylist)).documents
     return results
+
+
+def get_findingaids(context):
+    """return the (sorted) findingaid values of the ead files in the index"""
+    response = context.solr_ead.search(
+        q='-status:0',
+        rows=0,
+        facet='true',
+        **{
+            'facet.field': 'findingaid',
+            'facet.limit': -1,
+            'facet.mincount': 1,
+        }
+    )
+    return sorted(response.facets['facet_fields']['findingaid'])
+
+
+def ead_solr_to_json(request, document):
+    """these are the data of an ead file as returned by the server (cf. EadFile.to_dict)"""
+    keys = [
+        'archive',
+        'archive_id',
+        'country',
+        'dateLastModified',
+        'ead_id',
+        'findingaid',
+        'institution',
+        'language',
+        'status',
+        'title',
+    ]
+    result = {}
+    for key in keys:
+        result[key] = document.get(key)
+    result['URL'] = request.route_url('ead_file', ead_id=document['ead_id'])
+    return result
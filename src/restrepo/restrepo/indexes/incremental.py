@@ -0,0 +1,189 @@
+"""
+Bring the index up to date with the database, without rebuilding it
+
+We remember the time of the last successful (full or incremental) reindex in the
+settings table. An incremental reindex then
+
+    - reindexes the scans that were modified since then or that are missing in the index,
+      removes scans that are not in the database anymore, and corrects
+      sequence numbers (which can change without the scan being modified)
+    - reindexes the EAD files (and their components) that were modified since then,
+      and removes EAD files (and their components) that are not in the database anymore
+      (the components count the scans in the index, so this comes after the scans)
+    - recomputes the archive files of all scans and EAD files that were changed
+
+If no reindex was recorded yet, we do a full reindex.
+"""
+
+import logging
+
+from sqlalchemy.orm import subqueryload
+
+from restrepo.db.archive import get_archives_dict
+from restrepo.db.archivefile import get_archivefile
+from restrepo.db.ead import EadFile, get_ead_file
+from restrepo.db.scans import Scan, get_scans_query
+from restrepo.db.settings import Settings
+from restrepo.db.solr import build_equality_query
+from restrepo.indexes import reindex_all, _batches
+from restrepo.indexes.archivefile import cast_scan_as_archivefile, cast_archivefile_as_component
+from restrepo.indexes.lists import store_component_trees, delete_component_trees
+from restrepo.utils import now, string_to_datetime, datetime_to_string_zulu
+
+logger = logging.getLogger(__name__)
+
+# the key in the settings table where we keep the time of the last reindex
+LAST_REINDEX_KEY = 'reindex.last_indexed'
+BATCH_SIZE = 1000
+
+
+def get_last_reindex(context):
+    setting = context.db.query(Settings).get(LAST_REINDEX_KEY)
+    if setting and setting.value:
+        return string_to_datetime(setting.value)
+
+
+def set_last_reindex(context, value):
+    setting = context.db.query(Settings).get(LAST_REINDEX_KEY)
+    if not setting:
+        setting = Settings()
+        setting.key = LAST_REINDEX_KEY
+        context.db.add(setting)
+    setting.value = datetime_to_string_zulu(value)
+    context.db.commit()
+
+
+def reindex_incremental(context):
+    """update the index with the changes in the database since the last reindex
+
+    returns a dictionary with the number of reindexed and deleted documents of each type
+    """
+    # changes made while we are running will be picked up by the next run
+    started = now()
+    since = get_last_reindex(context)
+    if since is None:
+        logger.info('no previous reindex found, reindexing everything')
+        reindex_all(context)
+        set_last_reindex(context, started)
+        return {}
+
+    report = {}
+    archivefiles = set()
+    archivefiles |= _reindex_scans(context, since, report)
+    # the components get their number of scans from the index
+    context.solr.commit()
+    archivefiles |= _reindex_ead_files(context, since, report)
+    # the archive files use the ead files, components and scans in the index
+    context.solr.commit()
+    _reindex_archivefiles(context, archivefiles, report)
+    context.solr.commit()
+    set_last_reindex(context, started)
+    logger.info('incremental reindex: %s' % report)
+    return report
+
+
+def _search_all(solr, q, fl, sort):
+    """yield all documents that match q, with the fields in fl"""
+    start = 0
+    while True:
+        documents = solr.search(q=q, fl=fl, sort=sort, start=start, rows=BATCH_SIZE).documents
+        for document in documents:
+            yield document
+        if len(documents) < BATCH_SIZE:
+            return
+        start += BATCH_SIZE
+
+
+def _archivefiles_of_ead(context, ead_id):
+    """return the (archive_id, archiveFile) tuples of the components of this ead file that are in the index"""
+    q = build_equality_query(ead_id=ead_id) + ' AND is_archiveFile:true'
+    return set(
+        (document['archive_id'], document['archiveFile'])
+        for document in _search_all(context.solr_eadcomponent, q, 'archive_id,archiveFile', 'eadcomponent_id asc')
+    )
+
+
+def _reindex_ead_files(context, since, report):
+    db_eads = dict(context.db.query(EadFile.name, EadFile.last_modified))
+    indexed_eads = set(document['ead_id'] for document in _search_all(context.solr_ead, '*:*', 'ead_id', 'ead_id asc'))
+    changed = [name for name, last_modified in db_eads.items()
+        if name not in indexed_eads or last_modified is None or last_modified > since]
+    deleted = indexed_eads - set(db_eads)
+
+    archivefiles = set()
+    for ead_id in changed + list(deleted):
+        archivefiles |= _archivefiles_of_ead(context, ead_id)
+        context.solr_eadcomponent.delete_by_query(build_equality_query(ead_id=ead_id))
+    for ead_id in deleted:
+        context.solr_ead.delete_by_query(build_equality_query(ead_id=ead_id))
+        delete_component_trees(ead_id)
+    for ead_id in changed:
+        ead_file = get_ead_file(context, ead_id)
+        context.solr_ead.update([ead_file.get_solr_data()])
+        components = [component.get_solr_data() for component in ead_file.extract_components()]
+        context.solr_eadcomponent.update(components)
+        store_component_trees(ead_id, components)
+        archivefiles |= set((c['archive_id'], c['archiveFile']) for c in components if c['is_archiveFile'])
+    report['ead'] = {'reindexed': len(changed), 'deleted': len(deleted)}
+    return archivefiles
+
+
+def _reindex_scans(context, since, report):
+    query = get_scans_query(context).with_entities(
+        Scan.number, Scan.sequenceNumber, Scan.last_modified, Scan.archive_id, Scan.archiveFile)
+    db_scans = dict((row[0], row[1:]) for row in query)
+    indexed_scans = dict(
+        (document['number'], (document.get('sequenceNumber'), document['archive_id'], document['archiveFile']))
+        for document in _search_all(context.solr_scan, '*:*', 'number,sequenceNumber,archive_id,archiveFile', 'number asc')
+    )
+
+    archivefiles = set()
+    to_index = []
+    to_renumber = []
+    for number, (sequenceNumber, last_modified, archive_id, archiveFile) in db_scans.items():
+        indexed = indexed_scans.get(number)
+        if indexed is None or last_modified is None or last_modified > since:
+            to_index.append(number)
+            archivefiles.add((archive_id, archiveFile))
+            if indexed:
+                archivefiles.add(indexed[1:])
+        elif indexed[0] != sequenceNumber:
+            to_renumber.append({'number': number, 'sequenceNumber': {'set': sequenceNumber}})
+    to_delete = [number for number in indexed_scans if number not in db_scans]
+    for number in to_delete:
+        archivefiles.add(indexed_scans[number][1:])
+
+    archives = get_archives_dict(context)
+    for numbers in _batches(sorted(to_index), BATCH_SIZE):
+        scans = context.db.query(Scan).filter(Scan.number.in_(numbers)).options(subqueryload('images'))
+        context.solr_scan.update([scan.get_solr_data(archives=archives) for scan in scans])
+    for documents in _batches(to_renumber, BATCH_SIZE):
+        context.solr_scan.update(documents)
+    for numbers in _batches(to_delete, BATCH_SIZE):
+        context.solr_scan.delete_by_query('number:(%s)' % ' OR '.join(str(number) for number in numbers))
+
+    report['scan'] = {'reindexed': len(to_index), 'renumbered': len(to_renumber), 'deleted': len(to_delete)}
+    return archivefiles
+
+
+def _reindex_archivefiles(context, archivefiles, report):
+    reindexed = deleted = 0
+    for archive_id, archiveFile in archivefiles:
+        archivefile = get_archivefile(context, archive_id=archive_id, archiveFile=archiveFile)
+        in_db = archivefile is not None
+        if not in_db:
+            archivefile = cast_scan_as_archivefile(context, {'archive_id': archive_id, 'archiveFile': archiveFile})
+            # the title may come from a component that does not exist anymore
+            archivefile.title = None
+        document = archivefile.get_solr_data(context)
+        if not in_db and not document['number_of_scans'] and not archivefile.get_titles(context):
+            # no scans, no components and no record in the database refer to this archive file anymore
+            context.solr_archivefile.delete_by_key(document['archivefile_id'])
+            deleted += 1
+            continue
+        context.solr_archivefile.update([document])
+        component = cast_archivefile_as_component(context, document)
+        if component:
+            context.solr_eadcomponent.update([component])
+        reindexed += 1
+    report['archivefile'] = {'reindexed': reindexed, 'deleted': deleted}
@@ -1,7 +1,13 @@
 
+import os
 import json
+import datetime
+from StringIO import StringIO
+from dateutil.tz import tzutc
+from restrepo.config import COMPONENT_TREE_SUBDIRECTORY
 from restrepo.utils import datetime_to_string_zulu
 from restrepo.db.solr import solr_escape
+from restrepo.storage import store_fileobj, file_exists, delete_file, real_path
 
 
 def search_components(context, **kwargs):
@@ -37,15 +43,15 @@ def search_components(context, **kwargs):
     conditions = []
     query_used = {}
     with_facets = kwargs.get('with_facets', True)
+    query = {
+        'start': start,
+        'rows': limit,
+    }
     if with_facets:
-        query = {
+        query.update({
             'facet': 'true',
             'facet.field': ['country', 'language'],
-            'start': start,
-            'rows': limit,
-        }
-    else:
-        query = {}
+        })
 
     date_from = kwargs.get('date_from')
     date_to = kwargs.get('date_to')
@@ -123,42 +129,80 @@ def search_components(context, **kwargs):
     }
 
 
-def get_tree(context, ead_id, prune_tree=True):
+def build_tree(components, prune_tree=True):
     """
-    search for components in the given ead file, and construct a tree representation
+    construct a tree representation of the components (dictionaries, in the order of the ead file)
 
     if prune_tree is true, then we will return a pruned tree
-        (i.e. pruning lots of leaf nodes)
+        (i.e. only the components that have show_in_tree)
     """
     if prune_tree:
-        show_in_tree = True
-    else:
-        show_in_tree = None
-    results = search_components(
-        context=context,
-        ead_id=ead_id,
-        limit=100000,
-        show_in_tree=show_in_tree,
-        )['results']
+        components = [c for c in components if c.get('show_in_tree')]
 
     # create a lookup dictionary to quickly find children of a component
     lookup_dict = {}
-    for c in results:
-        parent = c.get('parent', None)
-        lookup_dict[parent] = lookup_dict.get(parent, []) + [c]
-
-    def get_children(component):
-        try:
-            return lookup_dict[component['eadcomponent_id']]
-        except KeyError:
-            return []
+    for c in components:
+        lookup_dict.setdefault(c.get('parent', None), []).append(c)
 
     def to_json(component):
         return {
             'title': component['title'],
             'xpath': component['xpath'],
-            'children': [to_json(c) for c in get_children(component)],
+            'children': [to_json(c) for c in lookup_dict.get(component['eadcomponent_id'], [])],
         }
 
-    results = [to_json(c) for c in results if c.get('parent') is None]
-    return results
+    return [to_json(c) for c in lookup_dict.get(None, [])]
+
+
+def _component_tree_path(ead_id, prune_tree):
+    return os.path.join(COMPONENT_TREE_SUBDIRECTORY, '%s.%s.json' % (ead_id, prune_tree and 'pruned' or 'full'))
+
+
+def store_component_trees(ead_id, components):
+    """build the (pruned and full) trees of the components of this ead file, and store them"""
+    for prune_tree in (True, False):
+        data = json.dumps(build_tree(components, prune_tree=prune_tree), separators=(',', ':'))
+        store_fileobj(_component_tree_path(ead_id, prune_tree), StringIO(data))
+
+
+def delete_component_trees(ead_id):
+    for prune_tree in (True, False):
+        path = _component_tree_path(ead_id, prune_tree)
+        if file_exists(path):
+            delete_file(path)
+
+
+def get_stored_tree(context, ead_id, prune_tree=True):
+    """
+    return a tuple (data, last_modified) where data is the stored tree of the ead file, serialized as json
+
+    if the tree was not stored (yet), we construct it from the index and store it
+    """
+    path = _component_tree_path(ead_id, prune_tree)
+    if not file_exists(path):
+        components = search_components(
+            context=context,
+            ead_id=ead_id,
+            limit=100000,
+            with_facets=False,
+            )['results']
+        if not components:
+            # there is no such ead file (or it is not indexed yet)
+            return '[]', None
+        store_component_trees(ead_id, components)
+    realpath = real_path(path, create=False)
+    with open(realpath) as fh:
+        data = fh.read()
+    last_modified = datetime.datetime.fromtimestamp(os.path.getmtime(realpath), tzutc())
+    return data, last_modified
+
+
+def get_tree(context, ead_id, prune_tree=True):
+    """
+    return a tree representation of the components in the given ead file
+
+    if prune_tree is true, then we will return a pruned tree
+        (i.e. pruning lots of leaf nodes)
+    """
+    data, _last_modified = get_stored_tree(context, ead_id, prune_tree=prune_tree)
+    return json.loads(data)
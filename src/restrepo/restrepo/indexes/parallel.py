@@ -0,0 +1,135 @@
+"""
+Rebuild the whole index using several processes
+
+The EAD files are parsed in a pool of worker processes (one EAD file per task),
+and the resulting documents are sent to solr from a pool of threads while the
+workers continue parsing.
+
+The phases are run in this order:
+
+    ead files       and, at the same time, scans
+    components      (these need the scans in the index for number_of_scans)
+    archive files   (these need the ead files, components and scans in the index)
+"""
+
+import time
+import logging
+import itertools
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from restrepo.db.ead import EadFile, get_ead_file
+from restrepo.indexes import reindex_scans, reindex_archivefiles, _batches
+from restrepo.indexes.lists import store_component_trees
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# the context of a worker process
+_worker_context = None
+
+
+def _init_worker(context_factory):
+    global _worker_context
+    _worker_context = context_factory()
+
+
+def _ead_file_document(ead_id):
+    return get_ead_file(_worker_context, ead_id).get_solr_data()
+
+
+def _ead_component_documents(task):
+    ead_id, store_trees = task
+    ead_file = get_ead_file(_worker_context, ead_id)
+    documents = [component.get_solr_data() for component in ead_file.extract_components()]
+    if store_trees:
+        store_component_trees(ead_id, documents)
+    return documents
+
+
+class SolrPoster(object):
+    """send documents to a solr index from a pool of threads"""
+
+    def __init__(self, solr, threads):
+        self.solr = solr
+        self.pool = ThreadPool(threads)
+        self.results = []
+
+    def update(self, documents):
+        """send documents (an iterable) in batches, without waiting for solr to respond"""
+        for batch in _batches(documents, BATCH_SIZE):
+            self.results.append(self.pool.apply_async(self.solr.update, (batch,)))
+
+    def wait(self):
+        """wait until all documents are sent, and commit"""
+        self.pool.close()
+        self.pool.join()
+        for result in self.results:
+            # this raises the exception if the update failed
+            result.get()
+        self.solr.commit()
+
+
+def _reindex_ead_files(context, pool, workers, delete):
+    if delete:
+        context.solr_ead.delete_by_query('*:*')
+    ead_ids = [name for (name,) in context.db.query(EadFile.name)]
+    poster = SolrPoster(context.solr_ead, workers)
+    poster.update(pool.imap_unordered(_ead_file_document, ead_ids))
+    poster.wait()
+
+
+def _reindex_components(context, pool, workers, delete, store_trees):
+    if delete:
+        context.solr_eadcomponent.delete_by_query('*:*')
+    tasks = [(name, store_trees) for (name,) in context.db.query(EadFile.name)]
+    poster = SolrPoster(context.solr_eadcomponent, workers)
+    poster.update(itertools.chain.from_iterable(pool.imap_unordered(_ead_component_documents, tasks)))
+    poster.wait()
+
+
+def reindex_all_parallel(context_factory, workers, delete=True, store_trees=True):
+    """rebuild the index using `workers` processes
+
+    context_factory is a callable that returns a new context (with a db session and solr connections)
+    if store_trees is false, the stored component trees are not replaced
+    returns a list of (phase, seconds) tuples
+    """
+    timings = []
+    errors = []
+
+    def timed(name, function, *args):
+        start = time.time()
+        try:
+            function(*args)
+        except Exception, error:
+            logger.exception(error)
+            errors.append(error)
+        timings.append((name, time.time() - start))
+        logger.info('{name}: {seconds:.1f} seconds'.format(name=name, seconds=timings[-1][1]))
+
+    start = time.time()
+    # we start the processes before we open any connection
+    pool = Pool(workers, _init_worker, (context_factory,))
+    try:
+        context = context_factory()
+        if delete:
+            context.solr.delete_by_query('*:*')
+        # the scans do not depend on the other indexes, so we index them while we process the ead files
+        scans_thread = threading.Thread(target=timed, args=('scans', reindex_scans, context_factory(), delete))
+        scans_thread.start()
+        timed('ead files', _reindex_ead_files, context, pool, workers, delete)
+        scans_thread.join()
+        if not errors:
+            timed('components', _reindex_components, context, pool, workers, delete, store_trees)
+        if not errors:
+            timed('archive files', reindex_archivefiles, context, delete)
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise errors[0]
+    timings.append(('total', time.time() - start))
+    return timings
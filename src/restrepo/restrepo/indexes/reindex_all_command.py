@@ -6,6 +6,9 @@ from sqlalchemy.orm import sessionmaker
 from restrepo.db.solr import Solr
 from restrepo.db import SolrWrapper
 from restrepo.indexes import reindex_all, reindex_scans, reindex_archivefiles, reindex_ead_files, reindex_components
+from restrepo.indexes.shadow import LIVE_CORE, SHADOW_CORE, verify_counts, swap_cores, store_component_trees_from_index
+from restrepo.indexes.incremental import reindex_incremental, set_last_reindex
+from restrepo.utils import now
 
 
 def extract_urls(text):
@@ -35,31 +38,86 @@ def extract_urls(text):
 
 def reindex_all_command(delete=True):
     context = get_context()
+    started = now()
     reindex_all(context, delete=delete)
+    set_last_reindex(context, started)
 
 
-def get_context():
+def reindex_incremental_command():
+    context = get_context()
+    report = reindex_incremental(context)
+    for entity_type, counts in sorted(report.items()):
+        print '%-15s %s' % (entity_type, ', '.join('%s: %i' % item for item in sorted(counts.items())))
+
+
+def get_context(core=LIVE_CORE):
     inifile = sys.argv[1]
     inifile_contents = open(inifile).read()
     sqlalchemy_url, solr_url = extract_urls(inifile_contents)
-    context = Context(sqlalchemy_url, solr_url)
+    context = Context(sqlalchemy_url, solr_url, core=core)
     return context
 
 
+def get_shadow_context():
+    return get_context(core=SHADOW_CORE)
+
+
+def reindex_shadow_command(workers=None):
+    """reindex into the shadow core, check the result, and swap it with the live core"""
+    from restrepo.indexes.parallel import reindex_all_parallel
+    context = get_shadow_context()
+    started = now()
+    # the live index still serves the stored trees, so we store the new ones only after the swap
+    if workers:
+        reindex_all_parallel(get_shadow_context, workers, store_trees=False)
+    else:
+        reindex_all(context, store_trees=False)
+    live_context = get_context()
+    report = verify_counts(context, live_context.solr, context.solr)
+    for entity_type, (live, shadow) in sorted(report.items()):
+        print '%-15s live: %8i new: %8i' % (entity_type, live, shadow)
+    swap_cores(context.solr_url)
+    # after the swap, the live core has the new index
+    store_component_trees_from_index(live_context)
+    set_last_reindex(context, started)
+
+
 class Context(object):
     """A context for reindex_all"""
-    def __init__(self, sqlalchemy_url, solr_url):
+    def __init__(self, sqlalchemy_url, solr_url, core=LIVE_CORE):
         self.sqlalchemy_url = sqlalchemy_url
+        self.solr_url = solr_url
         engine = create_engine(sqlalchemy_url)
         self.db = sessionmaker(bind=engine)()
-        self.solr = Solr(solr_url + 'entity')
+        self.solr = Solr(solr_url + core)
         self.solr_ead = SolrWrapper(self.solr, 'ead', 'ead_id')
         self.solr_eadcomponent = SolrWrapper(self.solr, 'eadcomponent', 'eadcomponent_id')
         self.solr_scan = SolrWrapper(self.solr, 'scan', 'number')
         self.solr_archivefile = SolrWrapper(self.solr, 'archivefile', 'archivefile_id')
 
 
+def reindex_all_parallel_command(workers, delete=True):
+    from restrepo.indexes.parallel import reindex_all_parallel
+    started = now()
+    timings = reindex_all_parallel(get_context, workers, delete=delete)
+    set_last_reindex(get_context(), started)
+    for phase, seconds in timings:
+        print '%-15s %8.1f seconds' % (phase, seconds)
+
+
 if __name__ == '__main__':
+    # usage: reindex_all_command.py inifile [phase [delete]] [--workers N] [--shadow] [--incremental]
+    workers = None
+    if '--workers' in sys.argv:
+        i = sys.argv.index('--workers')
+        workers = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+    shadow = '--shadow' in sys.argv
+    if shadow:
+        sys.argv.remove('--shadow')
+    incremental = '--incremental' in sys.argv
+    if incremental:
+        sys.argv.remove('--incremental')
     delete = True
     if len(sys.argv) > 3:
         delete = sys.argv[3]
@@ -77,5 +135,11 @@ if __name__ == '__main__':
             reindex_components(context, delete=delete)
         else:
             raise "unknown second argument %s" % sys.argv[2]
+    elif incremental:
+        reindex_incremental_command()
+    elif shadow:
+        reindex_shadow_command(workers)
+    elif workers:
+        reindex_all_parallel_command(workers, delete=delete)
     else:
         reindex_all_command(delete=delete)
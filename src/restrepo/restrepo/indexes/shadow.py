@@ -0,0 +1,90 @@
+"""
+Rebuild the index in a second ("shadow") solr core while the live core keeps serving
+
+When the shadow core is complete, we check that it has the documents we expect,
+and swap it with the live core (using the solr CoreAdmin SWAP action). After the
+swap, the name of the live core (`LIVE_CORE`) refers to the new index, so nothing
+needs to change in the configuration of the application, and the old index
+remains available in the shadow core (swapping again restores it).
+
+The stored component trees are not touched while the shadow core is filled: they
+are rebuilt from the new live index after the swap (cf. store_component_trees_from_index),
+so a shadow index that fails verification is never used.
+
+Note that changes made to the live core while the shadow core is being filled are
+not in the new index: avoid editing while a reindex runs, or reindex
+the changed entities afterwards.
+"""
+
+import logging
+import requests
+
+from restrepo.db.ead import EadFile
+from restrepo.db.scans import get_scans_query
+from restrepo.indexes.lists import search_components, store_component_trees
+
+logger = logging.getLogger(__name__)
+
+LIVE_CORE = 'entity'
+SHADOW_CORE = 'entity_shadow'
+ENTITY_TYPES = ('ead', 'eadcomponent', 'archivefile', 'scan')
+
+
+class ShadowIndexException(Exception):
+    "The shadow index is not complete"
+
+
+def count_by_entity_type(solr):
+    """return a dictionary {entity_type: number of documents} for the solr core"""
+    return dict(
+        (entity_type, solr.search(q='entity_type:%s' % entity_type, rows=0).total_results)
+        for entity_type in ENTITY_TYPES
+    )
+
+
+def verify_counts(context, live_solr, shadow_solr):
+    """check that the shadow index contains what we expect, raise ShadowIndexException if it does not
+
+    the number of scans and ead files must be equal to the number in the database;
+    the other entity types must be present in the shadow index if they are in the live index
+
+    returns a dictionary {entity_type: (live count, shadow count)}
+    """
+    live = count_by_entity_type(live_solr)
+    shadow = count_by_entity_type(shadow_solr)
+    report = dict((entity_type, (live[entity_type], shadow[entity_type])) for entity_type in ENTITY_TYPES)
+    expected = {
+        'scan': get_scans_query(context).count(),
+        'ead': context.db.query(EadFile).count(),
+    }
+    errors = []
+    for entity_type in ENTITY_TYPES:
+        if entity_type in expected:
+            if shadow[entity_type] != expected[entity_type]:
+                errors.append('expected {expected} documents of type {entity_type}, found {found}'.format(
+                    expected=expected[entity_type], entity_type=entity_type, found=shadow[entity_type]))
+        elif live[entity_type] and not shadow[entity_type]:
+            errors.append('no documents of type {entity_type} found'.format(entity_type=entity_type))
+    if errors:
+        raise ShadowIndexException('; '.join(errors))
+    return report
+
+
+def swap_cores(solr_url, core=LIVE_CORE, other=SHADOW_CORE):
+    """swap the two solr cores (solr_url is the url of solr, without the name of a core)"""
+    response = requests.get(solr_url + 'admin/cores', params={
+        'action': 'SWAP',
+        'core': core,
+        'other': other,
+        'wt': 'json',
+    })
+    if response.status_code != 200:
+        raise ShadowIndexException('Swapping cores failed: %s' % response.content)
+    logger.info('swapped solr cores {core} and {other}'.format(core=core, other=other))
+
+
+def store_component_trees_from_index(context):
+    """store the component trees of all ead files, built from the components in the index of context"""
+    for (ead_id,) in context.db.query(EadFile.name):
+        components = search_components(context, ead_id=ead_id, limit=100000, with_facets=False)['results']
+        store_component_trees(ead_id, components)
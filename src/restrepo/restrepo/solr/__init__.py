@@ -1,6 +1,28 @@
 import re
+import json
+import time
 import types
+import requests
+from requests.adapters import HTTPAdapter
 from mysolr import Solr as Solr_original
+from mysolr.mysolr import build_request
+from mysolr.response import SolrResponse
+from mysolr.compat import urljoin
+
+# the default number of connections to solr that are kept open
+DEFAULT_POOL_SIZE = 10
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    """return an http session that keeps up to pool_size connections to solr open
+
+    the session can be shared by all Solr objects (and threads) of a process
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class Solr(Solr_original):
@@ -9,37 +31,171 @@ class Solr(Solr_original):
         base_url='http://localhost:8080/solr/',
         auth=None,
         version=None,
+        session=None,
+        timeout=None,
+        buffered=False,
+        commit_within=None,
     ):
-        "Explicitly set version to 4 to save an http call"
+        """Explicitly set version to 4 to save an http call
+
+        session is a requests session (cf. make_session) - if it is not given, we make one for this object
+        timeout is the number of seconds we wait for solr to respond (default is no limit)
+        if buffered is true, updates and deletes are kept until the next commit (or flush),
+        and are then sent to solr in a single request
+        if commit_within is given, we ask solr to commit our changes within that many milliseconds
+        """
         super(Solr, self).__init__(base_url, auth, version=4)
+        self.session = session or make_session()
+        self.timeout = timeout
+        # number of calls to solr, and the time we spent waiting for them
+        self.calls = 0
+        self.seconds = 0.0
+        self.buffered = buffered
+        self.commit_within = commit_within
+        # True if we sent (or buffered) changes that are not committed yet
+        self.changed = False
+        self._reset_buffer()
+
+    def _request(self, method, url, **kwargs):
+        start = time.time()
+        try:
+            return self.session.request(method, url, auth=getattr(self, 'auth', None), timeout=self.timeout, **kwargs)
+        finally:
+            self.calls += 1
+            self.seconds += time.time() - start
+
+    def _search(self, resource='select', **kwargs):
+        # we post the query (as mysolr does), so that long queries do not run into limits on the length of urls
+        query = build_request(kwargs)
+        http_response = self._request('post', urljoin(self.base_url, resource), data=query)
+        return SolrResponse(http_response)
+
+    def _update_params(self):
+        if self.commit_within:
+            return {'commitWithin': self.commit_within}
+
+    def _post_xml(self, xml):
+        xml_data = xml.encode('utf-8')
+        headers = {'Content-type': 'text/xml; charset=utf-8'}
+        return self._request(
+            'post', urljoin(self.base_url, 'update'), data=xml_data, headers=headers, params=self._update_params())
+
+    def _post_json(self, json_doc):
+        json_data = json_doc.encode('utf-8')
+        headers = {'Content-type': 'application/json; charset=utf-8'}
+        return self._request(
+            'post', urljoin(self.base_url, 'update/json'), data=json_data, headers=headers, params=self._update_params())
 
     def search(self, *args, **kwargs):
-        result = super(Solr, self).search(*args, **kwargs)
+        result = self._search(*args, **kwargs)
         if result.status != 200:
             raise SolrException(result.raw_content)
         return result
 
-    def update(self, *args, **kwargs):
-        kwargs['commit'] = kwargs.setdefault('commit', False)
-        result = super(Solr, self).update(*args, **kwargs)
+    def _check(self, result):
         if result.status != 200:
             raise SolrException(result.raw_content)
         return result
 
-    def delete_by_key(self, *args, **kwargs):
-        kwargs['commit'] = kwargs.setdefault('commit', False)
-        result = super(Solr, self).delete_by_key(*args, **kwargs)
-        if result.status != 200:
-            raise SolrException(result.raw_content)
-        return result
+    def update(self, documents, input_type='json', commit=False):
+        self.changed = True
+        if self.buffered and not commit:
+            for document in documents:
+                self._buffer_add(document)
+            return
+        self.flush()
+        return self._check(super(Solr, self).update(documents, input_type=input_type, commit=commit))
 
-    def delete_by_query(self, *args, **kwargs):
-        kwargs['commit'] = kwargs.setdefault('commit', False)
-        result = super(Solr, self).delete_by_query(*args, **kwargs)
-        if result.status != 200:
-            raise SolrException(result.raw_content)
+    def delete_by_key(self, identifier, commit=False):
+        self.changed = True
+        if self.buffered and not commit:
+            self._buffer_delete({'id': identifier})
+            return
+        self.flush()
+        return self._check(super(Solr, self).delete_by_key(identifier, commit=commit))
+
+    def delete_by_query(self, query, commit=False):
+        self.changed = True
+        if self.buffered and not commit:
+            self._buffer_delete({'query': query})
+            return
+        self.flush()
+        return self._check(super(Solr, self).delete_by_query(query, commit=commit))
+
+    def commit(self, *args, **kwargs):
+        self.flush()
+        result = self._check(super(Solr, self).commit(*args, **kwargs))
+        self.changed = False
         return result
 
+    def _buffer_add(self, document):
+        pending = self._pending_documents.get(document['id'])
+        if pending is not None and _merge_documents(pending, document):
+            return
+        document = dict(document)
+        self._buffer.append(('add', {'doc': document}))
+        if pending is not None:
+            # we could not merge it (it is an 'inc' or similar operation): later updates of the
+            # document are buffered after it, so that solr applies them in the order they were made
+            self._pending_documents.pop(document['id'])
+        else:
+            self._pending_documents[document['id']] = document
+
+    def _buffer_delete(self, condition):
+        self._buffer.append(('delete', condition))
+        # we do not merge updates across a delete
+        self._pending_documents = {}
+
+    def flush(self):
+        """send the buffered updates and deletes to solr, in the order in which they were made"""
+        if not self.buffered or not self._buffer:
+            return
+        # the json update syntax allows a key to be repeated, and processes the commands in order
+        body = '{%s}' % ','.join('%s:%s' % (json.dumps(command), json.dumps(data)) for command, data in self._buffer)
+        self._reset_buffer()
+        self._check(SolrResponse(self._post_json(body)))
+
+    def discard(self):
+        """forget the buffered updates and deletes"""
+        if self.buffered:
+            self.changed = False
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self._buffer = []
+        # the documents in the buffer that later updates of the same document can be merged with, by id
+        self._pending_documents = {}
+
+
+def _is_partial_update(document):
+    return any(isinstance(value, dict) for value in document.values())
+
+
+def _merge_documents(pending, document):
+    """merge document into pending (a buffered update of the same document), if we can
+
+    returns True if the document was merged
+    """
+    if not _is_partial_update(document):
+        # the new version of the document replaces the old one
+        pending.clear()
+        pending.update(document)
+        return True
+    operations = [value for value in document.values() if isinstance(value, dict)]
+    if any(operation.keys() != ['set'] for operation in operations):
+        # we only merge 'set' operations, the others (such as 'inc') depend on the stored value
+        return False
+    for key, value in document.items():
+        if isinstance(value, dict) and not _is_partial_update(pending):
+            if value['set'] is None:
+                # setting a field to null removes it
+                pending.pop(key, None)
+            else:
+                pending[key] = value['set']
+        else:
+            pending[key] = value
+    return True
+
 
 class SolrWrapper(object):
     "Wrap a Solr object. Intercepting all queries and add a fixed stanza."
@@ -3,8 +3,22 @@
 #
 
 import os
+import shutil
+import tempfile
 from restrepo import REPO
 
+# we copy uploaded files in chunks of this size
+CHUNK_SIZE = 1024 * 1024
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# the mode that open() gives to new files (mkstemp creates them readable for the owner only)
+FILE_MODE = 0o666 & ~_get_umask()
+
 
 def real_path(filepath, create=True):
     "return the real os path from a repo file path"
@@ -24,6 +38,27 @@ def store_file(filepath, filecontents):
         fh.write(filecontents)
 
 
+def store_fileobj(filepath, fileobj):
+    """store the contents of the file-like object fileobj, without reading it in memory at once
+
+    the data are written to a temporary file that is renamed when complete,
+    so that a half-written file is never visible at filepath
+    """
+    realpath = real_path(filepath)
+    dirname, filename = os.path.split(realpath)
+    fileobj.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.%s.' % filename)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            shutil.copyfileobj(fileobj, fh, CHUNK_SIZE)
+        os.chmod(tmp_path, FILE_MODE)
+        os.rename(tmp_path, realpath)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
 def get_file_handle(filepath):
     return open(real_path(filepath))
 
@@ -181,7 +181,7 @@ class BaseRepoTest(unittest.TestCase):
         self.db = self.session
 
         # fill the archives table
-        from restrepo.db.archive import archive_table
+        from restrepo.db.archive import archive_table, archive_registry
         for archive in TEST_ARCHIVES:
             self.session.execute(archive_table.insert(archive))
         current_max = max(a[0] for a in TEST_ARCHIVES)
@@ -189,6 +189,8 @@ class BaseRepoTest(unittest.TestCase):
         self.session.execute("ALTER SEQUENCE archive_id_seq RESTART WITH %i" % new_max)
 
         self.session.commit()
+        # we changed the archive table behind the back of the archive registry
+        archive_registry.invalidate()
 
         def tear_down():
             nuke_storage()
@@ -1,10 +1,15 @@
 import os
+import time
 
 from pyramid.threadlocal import get_current_registry
 
 from base import BaseRepoTest
 from base import TESTFILES_DIR
+from base import localurl
 from restrepo.db.settings import Settings
+from restrepo.db.scans import Scan
+from restrepo.storage import real_path
+from restrepo.thumbnails import get_watermark_settings
 
 
 class AdminInterfaceTest(BaseRepoTest):
@@ -59,3 +64,41 @@ class AdminInterfaceTest(BaseRepoTest):
 #         self.config.registry.settings
 
 #         self.assertEqual(settings.get('watermark_file'), filename)
+
+    def test_configuration_invalidates_watermark_cache(self):
+        from restrepo import thumbnails
+        thumbnails.get_scaled_watermark(self.registry.settings, (500, 500))
+        self.assertTrue(thumbnails._scaled_watermark_cache)
+
+        response = self.app.get('/configuration')
+        response.form['watermark_size'] = '20%'
+        response.form.submit({'submit': True})
+        self.assertFalse(thumbnails._scaled_watermark_cache)
+
+    def test_cache_stats(self):
+        scan = self.add_one_scan().json
+        url = localurl(scan['URL']) + '/image?size=x20'
+        stats = self.app.get('/configuration/cache').json
+        self.app.get(url)
+        self.app.get(url)
+        new_stats = self.app.get('/configuration/cache').json
+        # hits and misses are counted per process
+        self.assertEqual(new_stats['this_process']['misses'], stats['this_process']['misses'] + 1)
+        self.assertEqual(new_stats['this_process']['hits'], stats['this_process']['hits'] + 1)
+
+        # the use of a thumbnail is recorded in its access time, so its Last-Modified does not change
+        scan_object = self.db.query(Scan).one()
+        path = real_path(scan_object._thumbnail_path('x20', scan['images'][0]['id'], get_watermark_settings(self.registry.settings)))
+        an_hour_ago = time.time() - 3600
+        os.utime(path, (an_hour_ago, an_hour_ago))
+        self.app.get(url)
+        self.assertEqual(os.path.getmtime(path), an_hour_ago)
+        self.assertTrue(os.path.getatime(path) > an_hour_ago)
+
+        # with a tiny budget, the cached thumbnail is removed
+        self.registry.settings['thumbnails.cache_max_size'] = '1'
+        self.addCleanup(self.registry.settings.pop, 'thumbnails.cache_max_size')
+        new_stats = self.app.post('/configuration/cache').json
+        self.assertEqual(new_stats['max_size'], 1)
+        self.assertEqual(new_stats['evictions'], stats['evictions'] + 1)
+        self.assertEqual(new_stats['size'], 0)
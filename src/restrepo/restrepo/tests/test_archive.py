@@ -2,8 +2,10 @@
 Tests for EAD CRUD and validation
 """
 from restrepo import config
-from base import BaseRepoTest
-from restrepo.db.archive import get_archives
+from base import BaseRepoTest, PSQL_URL
+from restrepo import main
+from restrepo.db.archive import archive_table, get_archives, get_archive, ARCHIVE_VERSION_KEY
+from restrepo.db.settings import Settings
 
 
 class TestArchive(BaseRepoTest):
@@ -116,3 +118,51 @@ class TestArchive(BaseRepoTest):
         # another archive we cannot update with the same data
         url = config.SERVICE_ARCHIVE_ITEM.replace('{archive_id}', str(another_archive_id))
         self.app.put(url, data, status=400)
+
+    def test_archive_registry(self):
+        # the archives come from the registry, and are not in the session
+        archive = get_archives(self, archive_id=self.an_archive.id)[0]
+        self.assertFalse(archive in self.db)
+        self.assertEqual(archive.to_dict(), self.an_archive.to_dict())
+        self.assertEqual(
+            [a.id for a in get_archives(self, institution=archive.institution, archive=archive.archive)],
+            [archive.id])
+        self.assertEqual(
+            [a.id for a in get_archives(self, country=archive.country_code)],
+            [a.id for a in get_archives(self) if a.country_code == archive.country_code])
+        self.assertEqual(get_archives(self, archive_id='not a number'), [])
+
+        # changes made through the services are seen immediately
+        self.app.put(self.an_archive.url, {'archive_description': 'zzz'})
+        self.assertEqual(get_archives(self, archive_id=self.an_archive.id)[0].archive_description, 'zzz')
+        response = self.app.post(config.SERVICE_ARCHIVE_COLLECTION, {'archive': 'xxx', 'institution': 'yyy'})
+        self.assertEqual(get_archives(self, institution='yyy', archive='xxx')[0].id, response.json['id'])
+
+        # other processes see a new version in the settings table
+        version = self.db.query(Settings).get(ARCHIVE_VERSION_KEY).value
+        self.app.delete(config.SERVICE_ARCHIVE_ITEM.replace('{archive_id}', str(response.json['id'])))
+        self.db.expire_all()
+        self.assertNotEqual(self.db.query(Settings).get(ARCHIVE_VERSION_KEY).value, version)
+        self.assertEqual(get_archives(self, institution='yyy', archive='xxx'), [])
+
+    def test_get_archive_added_by_other_process(self):
+        # another process added an archive, and our registry has not seen it yet
+        get_archives(self)
+        self.db.execute(archive_table.insert({'id': 1000, 'country_code': 'GH', 'institution': 'yyy', 'archive': 'xxx'}))
+        self.db.commit()
+        self.assertEqual(get_archives(self, institution='yyy', archive='xxx'), [])
+        # get_archive looks in the database before giving up
+        self.assertEqual(get_archive(self, institution='yyy', archive='xxx').id, 1000)
+        self.assertEqual(get_archive(self, archive_id=1000).archive, 'xxx')
+        self.assertEqual(get_archives(self, institution='yyy', archive='xxx')[0].id, 1000)
+
+    def test_archive_version_not_in_settings(self):
+        # the version of the archives is kept in the settings table, but it is not configuration
+        self.app.put(self.an_archive.url, {'archive_description': 'zzz'})
+        self.assertTrue(self.db.query(Settings).get(ARCHIVE_VERSION_KEY))
+        wsgi_app = main({}, **{
+            'sqlalchemy.url': PSQL_URL,
+            'restrepo.repository_path': self.repo_path,
+            'solr.url': self.registry.settings['solr.url'],
+        })
+        self.assertNotIn(ARCHIVE_VERSION_KEY, wsgi_app.registry.settings)
@@ -18,6 +18,7 @@ from restrepo.tests.base import localurl
 from restrepo.indexes.ead import get_ead_files
 from restrepo.config import status, ERRORS
 from restrepo.indexes import reindex_all
+from restrepo.indexes.archivefile import cast_archivefile_as_component
 from restrepo import config
 
 
@@ -157,6 +158,14 @@ class TestArchiveFile(BaseRepoTest):
         response2 = self.solr_archivefile.search(q='sort_field:[* TO *]')
         self.assertEqual(response1.total_results, response2.total_results)
 
+    def test_component_of_archivefile_has_no_version(self):
+        # the component is sent to solr at the end of the request, so it should not fail on a version conflict
+        self.add_one_ead(dontlog=True)
+        component = self.solr_eadcomponent.search(q='is_archiveFile:true').documents[0]
+        self.assertTrue(component['_version_'])
+        archivefile = {'archive_id': component['archive_id'], 'archiveFile': component['archiveFile']}
+        self.assertFalse('_version_' in cast_archivefile_as_component(self, archivefile))
+
     def test_get_archivefile(self):
         scandata = self.add_one_scan(self.scan_data, dontlog=True).json
         url = config.SERVICE_ARCHIVEFILE_ITEM.replace('{archive_id}', str(scandata['archive_id'])).replace('{archiveFile}', scandata['archiveFile'])
@@ -5,7 +5,7 @@ from base import BaseRepoTest
 
 from restrepo import config
 from restrepo.indexes.lists import search_components
-from restrepo.db.ead import ead2view
+from restrepo.db.ead import ead2view, get_ead_file
 from restrepo.tests.base import localurl
 from restrepo.config import ERRORS
 from restrepo.indexes import reindex_all
@@ -282,6 +282,28 @@ class TestComponents(BaseRepoTest):
         self.assertEqual(result_0_0_0['title'], 'General Resolutions')
         self.assertEqual(len(result_0_0_0_0['children']), 3)
 
+    def test_component_tree_is_stored(self):
+        test_fn = 'ID-ANRI_K.66a_01.ead.xml'
+        filecontents = self.get_default_filecontents(filename=test_fn)
+        ead = self.add_one_ead(filecontents=filecontents, dontlog=True, filename=test_fn).json
+        url = config.SERVICE_COMPONENT_TREE
+        res = self.app.get(url, {'ead_id': ead['ead_id']})
+        self.assertTrue(res.etag)
+        self.assertTrue(res.last_modified)
+        # the tree did not change, so we get a 304
+        self.app.get(url, {'ead_id': ead['ead_id']}, headers={'If-None-Match': '"%s"' % res.etag}, status=304)
+
+        # if we update the ead file, we get the new tree
+        filetuple = ('file', test_fn, filecontents.replace('General Resolutions', 'Changed Resolutions'))
+        self.app.put(localurl(ead['URL']), upload_files=[filetuple], extra_environ={'dontlog_web_chats': '1'})
+        new_res = self.app.get(url, {'ead_id': ead['ead_id']}, headers={'If-None-Match': '"%s"' % res.etag})
+        self.assertNotEqual(new_res.etag, res.etag)
+        self.assertTrue('Changed Resolutions' in new_res.body)
+
+        # and if we delete it, there is no tree anymore
+        self.app.delete(localurl(ead['URL']))
+        self.assertEqual(self.app.get(url, {'ead_id': ead['ead_id']}).json['results'], [])
+
     def test_component_structure(self):
         """test if the component gives back all fields with decent content"""
         test_fn = 'ID-ANRI_K.66a_01.ead.xml'
@@ -341,6 +363,25 @@ class TestComponents(BaseRepoTest):
             if k not in ['number_of_scans', '_version_']:
                 self.assertEqual(c[k], new_c[k], k)
 
+    def test_component_data_on_reindex(self):
+        ead_id = self.add_one_ead(dontlog=True).json['ead_id']
+        response = self.app.get(config.SERVICE_COMPONENTS_COLLECTION, {'ead_id': ead_id, 'is_archiveFile': True})
+        c = response.json['results'][0]
+        self.add_five_scans({'archiveFile': c['archiveFile'], 'archive_id': c['archive_id']})
+        archivefile_url = config.SERVICE_ARCHIVEFILE_ITEM.replace('{archive_id}', str(c['archive_id'])).replace('{archiveFile}', c['archiveFile'])
+        self.app.put(localurl(archivefile_url), {'status': config.STATUS_PUBLISHED})
+
+        # the scans and statuses of all archive files are collected at once
+        number_of_scans, statuses = get_ead_file(self, ead_id).get_archivefile_data()
+        self.assertEqual(number_of_scans, {c['archiveFile']: 5})
+        self.assertEqual(statuses[c['archiveFile']], config.STATUS_PUBLISHED)
+
+        reindex_all(context=self)
+        qry = {'ead_id': ead_id, 'archiveFile': c['archiveFile']}
+        new_c = self.app.get(config.SERVICE_COMPONENTS_COLLECTION, qry).json['results'][0]
+        self.assertEqual(new_c['number_of_scans'], 5)
+        self.assertEqual(new_c['status'], config.STATUS_PUBLISHED)
+
     def test_component_status(self):
         """check that the status of the corresponding archivefile is returned with the component"""
         ead_data = self.add_one_ead(dontlog=True).json
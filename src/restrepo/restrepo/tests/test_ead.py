@@ -20,7 +20,7 @@ from lxml import etree
 from base import BaseRepoTest, localurl
 from restrepo import config
 from restrepo.utils import now
-from restrepo.db.ead import EadFile
+from restrepo.db.ead import EadFile, get_ead_file
 from restrepo.config import ERRORS
 from base import TESTFILES_DIR
 
@@ -146,6 +146,22 @@ class TestEad(BaseRepoTest):
         self.assertEqual(ead.content_type, 'text/xml')
         self.assertEqual(ead.body, newfilecontents)
 
+    def test_ead_update_xml_tree_cache(self):
+        filecontents = self.get_default_filecontents()
+        res = self.add_one_ead(filecontents=filecontents, dontlog=True)
+        ead_id = res.json['ead_id']
+        # the file is parsed once, and then taken from the cache
+        tree = get_ead_file(self, ead_id)._get_xml_tree()
+        self.assertTrue(get_ead_file(self, ead_id)._get_xml_tree() is tree)
+
+        # after an update, we get the new contents
+        newfilecontents = filecontents.replace('UNITTITLE', 'changed_string')
+        filetuple = ('file', 'test_file_123.xml', newfilecontents)
+        self.app.put(localurl(res.json['URL']), upload_files=[filetuple], extra_environ={'dontlog_web_chats': '1'})
+        new_tree = get_ead_file(self, ead_id)._get_xml_tree()
+        self.assertFalse(new_tree is tree)
+        self.assertTrue('changed_string' in etree.tostring(new_tree))
+
     def test_ead_update_with_empty_body(self):
         filecontents = self.get_default_filecontents()
         res = self.add_one_ead(filecontents=filecontents, dontlog=True)
@@ -227,6 +243,17 @@ class TestEad(BaseRepoTest):
             {'findingaid': 'NonExistingFindingAid'}).json
         self.assertEqual(res['total_results'], 0)
 
+    def test_search_results_from_index(self):
+        res = self.add_one_ead(dontlog=True).json
+        item = self.app.get(localurl(res['URL'])).json
+        # the results are served from the index, and look the same as the item itself
+        results = self.app.get(config.SERVICE_EAD_COLLECTION).json['results']
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result.pop('URL'), res['URL'])
+        self.assertEqual(result, item)
+        self.assertTrue(result['title'])
+
     def test_persistency(self):
         """test if all data survice saving and indexing"""
         original = self.add_one_ead().json
@@ -1,5 +1,13 @@
-from base import BaseRepoTest
-from restrepo.indexes import reindex_all
+import os
+from base import BaseRepoTest, PSQL_URL
+from restrepo.indexes import reindex_all, reindex_scans
+from restrepo.indexes.parallel import reindex_all_parallel
+from restrepo.indexes.reindex_all_command import Context
+from restrepo.indexes.shadow import verify_counts, ShadowIndexException, store_component_trees_from_index
+from restrepo.indexes.lists import _component_tree_path, build_tree, get_tree, search_components
+from restrepo.storage import real_path
+from restrepo.indexes.incremental import reindex_incremental, get_last_reindex, set_last_reindex
+from restrepo.utils import now
 
 TEST_FILENAME = 'ID-ANRI_K.66a_01.ead.xml'
 
@@ -128,3 +136,92 @@ class IndexEADTestCase(BaseRepoTest):
         self.assertEqual(len(docs), 43)
         docs = self.solr_archivefile.search(q='*:*').documents
         self.assertEqual(len(docs), 5)
+
+    def test_reindex_scans_in_batches(self):
+        self.add_five_scans()
+        self.solr_scan.delete_by_query('*:*', commit=True)
+        self.assertEqual(self.solr_scan.search(q='*:*').total_results, 0)
+
+        total = reindex_scans(context=self, batch_size=2, commit_interval=1)
+        self.assertEqual(total, 5)
+        docs = self.solr_scan.search(q='*:*', rows=10).documents
+        self.assertEqual(sorted(doc['sequenceNumber'] for doc in docs), [1, 2, 3, 4, 5])
+
+    def test_reindex_all_parallel(self):
+        self.add_one_ead(filename=TEST_FILENAME, filecontents=self.get_default_filecontents(filename=TEST_FILENAME), dontlog=True)
+        self.add_five_scans()
+        self.solr.delete_by_query('*:*', commit=True)
+
+        def context_factory():
+            return Context(PSQL_URL, self.registry.settings['solr.url'])
+
+        timings = reindex_all_parallel(context_factory, workers=2)
+        # ead files and scans are indexed at the same time, so they can finish in any order
+        self.assertEqual(sorted(phase for phase, _seconds in timings[:2]), ['ead files', 'scans'])
+        self.assertEqual([phase for phase, _seconds in timings[2:]], ['components', 'archive files', 'total'])
+
+        self.assertEqual(self.solr_scan.search(q='*:*').total_results, 5)
+        self.assertEqual(self.solr_ead.search(q='*:*').total_results, 1)
+        self.assertEqual(self.solr_eadcomponent.search(q='*:*').total_results, 43)
+        self.assertEqual(self.solr_archivefile.search(q='*:*').total_results, 5)
+
+    def test_shadow_reindex_keeps_component_trees(self):
+        ead_id = self.add_one_ead(dontlog=True).json['ead_id']
+        path = real_path(_component_tree_path(ead_id, True), create=False)
+        os.remove(path)
+        # the trees of the new index are only stored after it is verified and swapped in
+        reindex_all(self, store_trees=False)
+        self.assertFalse(os.path.exists(path))
+        store_component_trees_from_index(self)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(get_tree(self, ead_id), build_tree(
+            search_components(self, ead_id=ead_id, limit=100000, with_facets=False)['results']))
+
+    def test_verify_counts(self):
+        self.add_five_scans()
+        report = verify_counts(self, self.solr, self.solr)
+        self.assertEqual(report['scan'], (5, 5))
+        # if a scan is missing from the (new) index, we should not use it
+        self.solr_scan.delete_by_query('sequenceNumber:1', commit=True)
+        self.assertRaises(ShadowIndexException, verify_counts, self, self.solr, self.solr)
+
+    def test_reindex_incremental(self):
+        self.add_five_scans()
+        context = Context(PSQL_URL, self.registry.settings['solr.url'])
+        set_last_reindex(context, now())
+        last_reindex = get_last_reindex(context)
+
+        # a scan is missing from the index, and the index has a scan that is not in the database
+        self.solr_scan.delete_by_query('sequenceNumber:1')
+        document = self.solr_scan.search(q='sequenceNumber:2').documents[0]
+        del document['_version_']
+        document['number'] = 999999
+        self.solr_scan.update([document], commit=True)
+        self.assertEqual(self.solr_scan.search(q='*:*').total_results, 5)
+
+        report = reindex_incremental(context)
+        self.assertEqual(report['scan'], {'reindexed': 1, 'renumbered': 0, 'deleted': 1})
+        docs = self.solr_scan.search(q='*:*', rows=10).documents
+        self.assertEqual(sorted(doc['sequenceNumber'] for doc in docs), [1, 2, 3, 4, 5])
+        self.assertNotIn(999999, [doc['number'] for doc in docs])
+        self.assertTrue(get_last_reindex(context) > last_reindex)
+
+        # nothing changed, so nothing is reindexed
+        report = reindex_incremental(context)
+        self.assertEqual(report['scan'], {'reindexed': 0, 'renumbered': 0, 'deleted': 0})
+
+    def test_reindex_incremental_counts_new_scans_in_components(self):
+        self.add_one_ead(dontlog=True)
+        component = self.solr_eadcomponent.search(q='is_archiveFile:true').documents[0]
+        self.add_five_scans({'archiveFile': component['archiveFile'], 'archive_id': component['archive_id']})
+        context = Context(PSQL_URL, self.registry.settings['solr.url'])
+        set_last_reindex(context, now())
+
+        # the scans and the ead file are missing from the index, so both are reindexed
+        self.solr.delete_by_query('entity_type:(scan OR ead OR eadcomponent)', commit=True)
+        report = reindex_incremental(context)
+        self.assertEqual(report['scan']['reindexed'], 5)
+        self.assertEqual(report['ead']['reindexed'], 1)
+        # and the components are indexed after the scans, so they count them
+        q = 'eadcomponent_id:"%s"' % component['eadcomponent_id']
+        self.assertEqual(self.solr_eadcomponent.search(q=q).documents[0]['number_of_scans'], 5)
@@ -1,5 +1,8 @@
 import os
+import stat
 import glob
+import mock
+import threading
 from StringIO import StringIO
 from base import BaseRepoTest
 from base import TEST_IMAGE_TIF, localurl
@@ -10,6 +13,9 @@ from PIL import Image
 from restrepo.db.scans import Scan
 from restrepo.db.scan_images import ScanImage
 from restrepo.storage import real_path
+from restrepo import celery_tasks
+from restrepo import thumbnails
+from restrepo.thumbnails import get_watermark_settings
 
 
 class TestScanImages(BaseRepoTest):
@@ -89,6 +95,18 @@ class TestScanImages(BaseRepoTest):
         result = self.app.post(url, upload_files=[filetuple], extra_environ={'dontlog_web_chats': ''})
         self.assertEqual(len(result.json['images']), 1)
 
+    def test_scan_thumbnail_failed_render(self):
+        "If rendering a thumbnail fails, the next caller renders it"
+        self.scan.store_file(TEST_IMAGE_ZACKTHECAT, self.imageid)
+        original_path = self.scan.get_real_path(self.imageid)
+        thumbnail_path = real_path(self.scan._thumbnail_path('x50', self.imageid, {}))
+        with mock.patch('restrepo.thumbnails.render_thumbnail', side_effect=IOError):
+            self.assertRaises(IOError, thumbnails.ensure_thumbnail, original_path, thumbnail_path, 'x50', {})
+        self.assertFalse(os.path.exists(thumbnail_path + '.lock'))
+        thumbnails.ensure_thumbnail(original_path, thumbnail_path, 'x50', {})
+        self.assertTrue(os.path.exists(thumbnail_path))
+        self.assertFalse(os.path.exists(thumbnail_path + '.lock'))
+
     def test_scan_thumbnail_validation(self):
         "Invalid values for `size` should trigger a meaningful error"
         scan = self.add_one_scan().json
@@ -169,6 +187,48 @@ class TestScanImages(BaseRepoTest):
         second_thumbnail = self.app.get(url + '/image?size=100x').body
         self.assertTrue(first_thumbnail != second_thumbnail)
 
+    def test_thumbnails_are_pregenerated_on_upload(self):
+        "The sizes in thumbnails.pregenerate_sizes are rendered right after the upload"
+        celery_tasks.app.conf.update(CELERY_ALWAYS_EAGER=True)
+        self.addCleanup(celery_tasks.app.conf.update, CELERY_ALWAYS_EAGER=False)
+        self.registry.settings['thumbnails.pregenerate_sizes'] = 'x50 full'
+        self.addCleanup(self.registry.settings.pop, 'thumbnails.pregenerate_sizes')
+
+        scan_data = self.add_one_scan(filecontents=TEST_IMAGE_ZACKTHECAT).json
+        image_id = scan_data['images'][0]['id']
+        scan = self.db.query(Scan).filter(Scan.number == scan_data['number']).one()
+        watermark_settings = get_watermark_settings(self.registry.settings)
+        self.assertTrue(os.path.exists(real_path(scan._thumbnail_path('x50', image_id, watermark_settings))))
+        self.assertTrue(os.path.exists(real_path(scan._thumbnail_path(None, image_id, watermark_settings))))
+        # other sizes are not rendered
+        thumbnails = glob.glob(real_path(scan._thumbnail_basepath(image_id)) + '*')
+        self.assertEqual(len(thumbnails), 2)
+
+        # the pregenerated thumbnail is served as is
+        res = self.app.get(localurl(scan_data['URL']) + '/image?size=x50')
+        self.assertEqual(Image.open(StringIO(res.body)).size[1], 50)
+
+    def test_thumbnails_follow_watermark_settings(self):
+        "Changing the watermark settings makes cached thumbnails with the old settings obsolete"
+        scan_data = self.add_one_scan(filecontents=TEST_IMAGE_ZACKTHECAT).json
+        image_id = scan_data['images'][0]['id']
+        scan = self.db.query(Scan).filter(Scan.number == scan_data['number']).one()
+        url = localurl(scan_data['URL']) + '/image?size=200x'
+        first_thumbnail = self.app.get(url).body
+        old_path = real_path(scan._thumbnail_path('200x', image_id, get_watermark_settings(self.registry.settings)))
+        self.assertTrue(os.path.exists(old_path))
+
+        self.registry.settings['watermark_size'] = '50%'
+        self.addCleanup(self.registry.settings.update, watermark_size='10%')
+        second_thumbnail = self.app.get(url).body
+        self.assertNotEqual(first_thumbnail, second_thumbnail)
+        new_path = real_path(scan._thumbnail_path('200x', image_id, get_watermark_settings(self.registry.settings)))
+        self.assertNotEqual(old_path, new_path)
+        self.assertTrue(os.path.exists(new_path))
+        # other processes may still have the old settings, so the old thumbnail
+        # is not removed here: the eviction of the cache removes it when it is not used anymore
+        self.assertTrue(os.path.exists(old_path))
+
     def _add_one_scan_with_two_images(self):
         scan = self.add_one_scan(
             filename=['img1', 'img2'],
@@ -402,12 +462,47 @@ class TestScanObject(BaseRepoTest):
             self.assertEqual(fh.read(), self.TEST_IMAGE,
                 "Stored image is not the same as the one provided")
 
+    def test_scan_store_fileobj(self):
+        self.scan.store_file(StringIO(TEST_IMAGE_ZACKTHECAT), self.imageid)
+        path = self.scan.get_real_path(self.imageid)
+        with open(path) as fh:
+            self.assertEqual(fh.read(), TEST_IMAGE_ZACKTHECAT)
+        # no temporary files are left behind
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+        # and the file can be read by others, as a file stored with store_file
+        self.scan.store_file(TEST_IMAGE_ZACKTHECAT, 2)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(path).st_mode),
+            stat.S_IMODE(os.stat(self.scan.get_real_path(2)).st_mode))
+
     def test_scan_thumbnail(self):
         self.scan.store_file(TEST_IMAGE_ZACKTHECAT, self.imageid)
         path = self.scan.get_real_thumbnail_path('100x', self.imageid)
         with open(path) as fh:
             img = Image.open(fh)
         self.assertEqual(img.size, (100, 91))
+        # the thumbnail has the same permissions as the original
+        self.assertEqual(
+            stat.S_IMODE(os.stat(path).st_mode),
+            stat.S_IMODE(os.stat(self.scan.get_real_path(self.imageid)).st_mode))
+
+    def test_scan_thumbnail_single_flight(self):
+        "Concurrent requests for the same thumbnail render it only once"
+        self.scan.store_file(TEST_IMAGE_ZACKTHECAT, self.imageid)
+        original_path = self.scan.get_real_path(self.imageid)
+        thumbnail_path = real_path(self.scan._thumbnail_path('x50', self.imageid, {}))
+        with mock.patch('restrepo.thumbnails.render_thumbnail', wraps=thumbnails.render_thumbnail) as render:
+            threads = [
+                threading.Thread(target=thumbnails.ensure_thumbnail, args=(original_path, thumbnail_path, 'x50', {}))
+                for _i in range(10)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(render.call_count, 1)
+        # no lock or temporary files are left behind
+        self.assertEqual(glob.glob(os.path.join(os.path.dirname(thumbnail_path), '*x50*')), [thumbnail_path])
 
     def test_scan_thumbnail_validation(self):
         with self.assertRaises(ValueError):
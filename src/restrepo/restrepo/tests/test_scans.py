@@ -1,3 +1,6 @@
+import os
+import json
+import mock
 from base import BaseRepoTest, TEST_IMAGE_TIF, localurl
 from base import TEST_IMAGE_GIF, TEST_IMAGE_JPG, TEST_IMAGE_PNG
 from restrepo.db.archive import get_archive, get_archives
@@ -5,6 +8,8 @@ from restrepo.config import status as status_values
 from restrepo.config import ERRORS
 from restrepo import config
 from restrepo.utils import now, string_to_datetime
+from restrepo.db.scans import Scan
+from restrepo.db.scan_images import ScanImage
 
 
 class TestScans(BaseRepoTest):
@@ -220,6 +225,23 @@ class TestScans(BaseRepoTest):
         res = self.app.get(config.SERVICE_SCAN_COLLECTION + '/' + str(scan['number'])).json
         self.assert_dict_subset(self.scan_data, res)
 
+    def test_json_data_is_decoded_once(self):
+        number = self.add_one_scan(dict(self.scan_data, title='a title', transcription='a transcription')).json['number']
+        scan = self.db.query(Scan).get(number)
+        with mock.patch('restrepo.db.mixins.json', wraps=json) as mixins_json:
+            scan.get_solr_data()
+            self.assertEqual(scan.to_dict(dbdata_only=True)['title'], 'a title')
+            self.assertEqual(mixins_json.loads.call_count, 1)
+            # setting a value does not decode the data again
+            scan.title = 'another title'
+            self.assertEqual(scan.title, 'another title')
+            self.assertEqual(scan.transcription, 'a transcription')
+            self.assertEqual(mixins_json.loads.call_count, 1)
+        self.assertEqual(json.loads(scan.json_data)['title'], 'another title')
+        # new data from the database is decoded again
+        self.db.expire(scan)
+        self.assertEqual(scan.title, 'a title')
+
     def test_404_scan(self):
         """
         A missing scan should issue a proper NotFound response
@@ -865,3 +887,59 @@ class TestDeleteScans(BaseRepoTest):
         # try to remove the archivefile a second time
         result = self.app.post(config.SERVICE_UTILS_SCAN_DELETE, params={'archiveFile': 'a2', 'archive_id': archive_id})
         self.assertTrue(result.json['success'], 'True')
+
+    def test_delete_scans_removes_files_and_images(self):
+        archive_id = self.scan_data['archive_id']
+        scans = self.db.query(Scan).filter(Scan.archiveFile == 'a2').all()
+        paths = [scan.get_real_path(image.id) for scan in scans for image in scan.images]
+        numbers = [scan.number for scan in scans]
+        self.assertEqual(len(paths), 5)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+        self.app.post(config.SERVICE_UTILS_SCAN_DELETE, params={'archiveFile': 'a2', 'archive_id': archive_id})
+
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertEqual(self.db.query(Scan).filter(Scan.number.in_(numbers)).count(), 0)
+        self.assertEqual(self.db.query(ScanImage).filter(ScanImage.scan_number.in_(numbers)).count(), 0)
+        # the scans of the other archive file keep their sequence numbers
+        res = self.app.get(config.SERVICE_SCAN_COLLECTION, {'archiveFile': 'a1'}).json
+        self.assertEqual([scan['sequenceNumber'] for scan in res['results']], [1, 2, 3, 4, 5])
+
+
+class TestAddScans(BaseRepoTest):
+
+    def test_add_scans(self):
+        # add one scan in the usual way, the batch should come after it
+        self.add_one_scan()
+        upload_files = [
+            ('file', 'img%s' % i, contents)
+            for i, contents in enumerate([TEST_IMAGE_JPG, TEST_IMAGE_PNG, TEST_IMAGE_GIF])
+        ]
+        data = dict(self.scan_data)
+        data['title'] = 'a title'
+        result = self.app.post(config.SERVICE_UTILS_SCAN_ADD, data, upload_files=upload_files).json
+        self.assertEqual(result['total_results'], 3)
+        self.assertEqual([scan['sequenceNumber'] for scan in result['results']], [2, 3, 4])
+        self.assertEqual([scan['title'] for scan in result['results']], ['a title'] * 3)
+
+        res = self.app.get(config.SERVICE_SCAN_COLLECTION, {'archiveFile': self.scan_data['archiveFile']}).json
+        self.assertEqual(res['total_results'], 4)
+        self.assertEqual([scan['images'][0]['filename'] for scan in res['results'][1:]], ['img0', 'img1', 'img2'])
+        # the images can be retrieved
+        self.app.get(localurl(res['results'][3]['images'][0]['URL']))
+
+        # the archive file knows about the new scans
+        url_archivefile = config.SERVICE_ARCHIVEFILE_ITEM.format(**self.scan_data)
+        response = self.app.get(url_archivefile)
+        self.assertEqual(response.json['number_of_scans'], 4)
+
+    def test_add_scans_validation(self):
+        # files are required
+        result = self.app.post(config.SERVICE_UTILS_SCAN_ADD, self.scan_data, expect_errors=True)
+        self.assertEqual(result.json['errors'][0]['name'], ERRORS.invalid_file.name)
+        # and must be images
+        upload_files = [('file', 'img1', TEST_IMAGE_PNG), ('file', 'not_an_image', 'some text')]
+        result = self.app.post(config.SERVICE_UTILS_SCAN_ADD, self.scan_data, upload_files=upload_files, expect_errors=True)
+        self.assertEqual(result.json['errors'][0]['name'], ERRORS.invalid_file.name)
+        res = self.app.get(config.SERVICE_SCAN_COLLECTION, {'archiveFile': self.scan_data['archiveFile']}).json
+        self.assertEqual(res['total_results'], 0)
@@ -1,4 +1,10 @@
+import json
+import mock
 from .base import BaseRepoTest, localurl
+from restrepo import config
+from pyramid.response import Response
+from restrepo.db import DbRequest, commit_veto
+from restrepo.db.solr import Solr, SolrWrapper
 
 
 class TestSolrInterface(BaseRepoTest):
@@ -10,6 +16,71 @@ class TestSolrInterface(BaseRepoTest):
             self.solr_scan.update({'nonexistent': 1})
 
 
+    def test_solr_calls_are_reported(self):
+        self.add_one_scan()
+        response = self.app.get(config.SERVICE_SCAN_COLLECTION)
+        self.assertTrue(response.headers['Server-Timing'].startswith('solr;dur='))
+
+    def test_requests_share_a_session(self):
+        request = DbRequest.blank('/')
+        request.registry = self.app.app.registry
+        other_request = DbRequest.blank('/')
+        other_request.registry = self.app.app.registry
+        self.assertTrue(request.solr.session is other_request.solr.session)
+        # but they count their calls separately
+        request.solr.search(q='*:*')
+        self.assertEqual(request.solr.calls, 1)
+        self.assertEqual(other_request.solr.calls, 0)
+
+    def test_long_queries(self):
+        # the query is sent in the body of the request, so it can be longer than an url may be
+        q = 'archiveFile:(%s)' % ' OR '.join('an_archive_file_%05i' % i for i in range(1000))
+        self.assertEqual(self.solr_scan.search(q=q).total_results, 0)
+
+    def test_commit_only_after_changes(self):
+        request = DbRequest.blank('/')
+        request.registry = self.app.app.registry
+        request.solr.search(q='*:*')
+        commit_veto(request, Response())
+        # reading does not commit
+        self.assertEqual(request.solr.calls, 1)
+        request.solr_scan.update([{'number': 1}])
+        commit_veto(request, Response())
+        # the update, and the commit
+        self.assertEqual(request.solr.calls, 3)
+        self.assertEqual(self.solr_scan.search(q='number:1').total_results, 1)
+
+    def test_buffered_updates(self):
+        solr = Solr(self.solr.base_url, buffered=True)
+        solr_scan = SolrWrapper(solr, 'scan', 'number')
+        solr_scan.update([{'number': 1, 'sequenceNumber': 1}])
+        solr_scan.update([{'number': 1, 'sequenceNumber': {'set': 2}}])
+        self.assertEqual(solr.calls, 0)
+        # the updates are merged, and sent together with the commit
+        solr.commit()
+        self.assertEqual(solr.calls, 2)
+        self.assertEqual(self.solr_scan.search(q='number:1').documents[0]['sequenceNumber'], 2)
+
+        # updates that cannot be merged are sent in the order in which they were made
+        solr_scan.update([{'number': 1, 'sequenceNumber': {'set': 3}}])
+        solr_scan.update([{'number': 1, 'sequenceNumber': {'inc': 1}}])
+        solr_scan.update([{'number': 1, 'sequenceNumber': {'set': 10}}])
+        with mock.patch.object(solr, '_post_json', wraps=solr._post_json) as post_json:
+            solr.commit()
+        # (the body repeats the 'add' key, so we read it as a list of (key, value) pairs)
+        commands = json.loads(post_json.call_args[0][0], object_pairs_hook=lambda pairs: pairs)
+        self.assertEqual(
+            [dict(dict(data)['doc'])['sequenceNumber'] for _command, data in commands],
+            [[('set', 3)], [('inc', 1)], [('set', 10)]])
+        self.assertEqual(self.solr_scan.search(q='number:1').documents[0]['sequenceNumber'], 10)
+
+        # discarded changes are never sent
+        solr_scan.delete_by_key(1)
+        solr.discard()
+        solr.commit()
+        self.assertEqual(self.solr_scan.search(q='number:1').total_results, 1)
+
+
 class TestSolrEad(BaseRepoTest):
     "Ensure ead files are indexed in solr on creation/update/deletion"
 
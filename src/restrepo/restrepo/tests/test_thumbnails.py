@@ -0,0 +1,37 @@
+import os
+import unittest
+
+from PIL import Image
+
+from base import TESTFILES_DIR
+from restrepo.thumbnails import reduce_for_size
+
+
+def open_sample(filename):
+    return Image.open(os.path.join(TESTFILES_DIR, filename))
+
+
+class TestReduceForSize(unittest.TestCase):
+    # pyramid.tif has pages of 64x48, and reduced-resolution pages of 32x24 and 16x12
+    # multipage.tif has pages of 64x48 and 32x24 (with other content), and a
+    # page of 40x16 that is marked as a reduced-resolution page
+
+    def test_pyramid(self):
+        self.assertEqual(reduce_for_size(open_sample('pyramid.tif'), (10, 10)).size, (16, 12))
+        self.assertEqual(reduce_for_size(open_sample('pyramid.tif'), (20, 12)).size, (32, 24))
+        self.assertEqual(reduce_for_size(open_sample('pyramid.tif'), (40, 10)).size, (64, 48))
+        img = reduce_for_size(open_sample('pyramid.tif'), (16, 12))
+        self.assertEqual(img.size, (16, 12))
+        img.thumbnail((16, 12), Image.ANTIALIAS)
+        self.assertEqual(img.size, (16, 12))
+
+    def test_multipage(self):
+        # the other pages are not smaller versions of the first page, so we do not use them
+        for size in [(10, 10), (30, 10), (64, 48)]:
+            img = reduce_for_size(open_sample('multipage.tif'), size)
+            self.assertEqual(img.size, (64, 48))
+            self.assertEqual(img.convert('RGB').getpixel((0, 0)), open_sample('multipage.tif').convert('RGB').getpixel((0, 0)))
+
+    def test_single_page(self):
+        img = reduce_for_size(open_sample('zackthecat.tif'), (10, 10))
+        self.assertEqual(img.size, open_sample('zackthecat.tif').size)
@@ -0,0 +1,200 @@
+#
+# copyright Gerbrandy SRL
+# www.gerbrandy.com
+# 2013
+#
+
+"""
+bookkeeping for the cache of resized images (in CACHE_SUBDIRECTORY)
+
+The cache is kept within a byte budget (the `thumbnails.cache_max_size` setting)
+by removing the least recently used files. This is done by a single cron job
+(cf. evict_command) for all processes that share the cache:
+
+    bin/python src/restrepo/restrepo/thumbnail_cache.py restrepo.ini
+
+The "last used" time of a cached file is its access time, which is set (at
+most once every TOUCH_INTERVAL seconds) each time the file is served. We keep
+its modification time, because that is sent as Last-Modified.
+
+The hits and misses are counted by each process separately.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import ConfigParser
+from StringIO import StringIO
+
+from restrepo.config import CACHE_SUBDIRECTORY
+from restrepo import storage
+from restrepo.storage import real_path, store_fileobj
+
+logger = logging.getLogger(__name__)
+
+# we do not update the access time of files that were accessed less than this many seconds ago
+TOUCH_INTERVAL = 60
+# when we evict files, we remove files until the cache is this fraction of the budget
+EVICT_TO = 0.9
+# the result of the last eviction is kept in this file in the cache
+EVICTION_REPORT = '.eviction.json'
+
+# the hits and misses of this process
+_stats_lock = threading.Lock()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+}
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes, such as "500M" or "20G"
+
+    >>> parse_size('1024')
+    1024
+    >>> parse_size('2K')
+    2048
+    >>> parse_size('1.5G')
+    1610612736
+    >>> parse_size('') is None
+    True
+    """
+    if not value:
+        return None
+    value = str(value).strip().upper()
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def _increment(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def record_hit(path):
+    """the cached file at (real) path was served"""
+    _increment('hits')
+    now = time.time()
+    try:
+        stat = os.stat(path)
+        if stat.st_atime < now - TOUCH_INTERVAL:
+            os.utime(path, (now, stat.st_mtime))
+    except OSError:
+        # the file may have been evicted in the meantime
+        pass
+
+
+def record_miss():
+    """a file was not found in the cache, and had to be rendered"""
+    _increment('misses')
+
+
+def get_stats():
+    """return a dictionary with the result of the last eviction, and the hits and misses of this process"""
+    result = get_eviction_report()
+    with _stats_lock:
+        result['this_process'] = dict(_stats, pid=os.getpid())
+    return result
+
+
+def get_eviction_report():
+    """return the size of the cache and the number of evicted files, as found by the last eviction"""
+    path = real_path(os.path.join(CACHE_SUBDIRECTORY, EVICTION_REPORT), create=False)
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {
+            'evictions': 0,
+            'evicted_bytes': 0,
+            'size': None,
+            'files': None,
+            'last_check': None,
+        }
+
+
+def _is_cache_file(filename):
+    # skip lock files, (hidden) temporary files of renders in progress and the eviction report
+    return not filename.startswith('.') and not filename.endswith('.lock')
+
+
+def evict(max_size):
+    """
+    Remove the least recently used files from the cache until it is smaller than max_size
+
+    returns a tuple (number_of_removed_files, removed_bytes)
+    """
+    cache_directory = real_path(CACHE_SUBDIRECTORY, create=False)
+    entries = []
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(cache_directory):
+        for filename in filenames:
+            if not _is_cache_file(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+            total += stat.st_size
+
+    removed_files = removed_bytes = 0
+    if total > max_size:
+        entries.sort()
+        target = max_size * EVICT_TO
+        for _last_used, size, path in entries:
+            if total <= target:
+                break
+            if not _remove(path):
+                continue
+            total -= size
+            removed_files += 1
+            removed_bytes += size
+
+    report = get_eviction_report()
+    report['evictions'] += removed_files
+    report['evicted_bytes'] += removed_bytes
+    report['size'] = total
+    report['files'] = len(entries) - removed_files
+    report['last_check'] = time.time()
+    store_fileobj(os.path.join(CACHE_SUBDIRECTORY, EVICTION_REPORT), StringIO(json.dumps(report)))
+    if removed_files:
+        logger.info('Removed %s files (%s bytes) from the thumbnail cache' % (removed_files, removed_bytes))
+    return removed_files, removed_bytes
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        return False
+    return True
+
+
+def evict_command(inifile):
+    """keep the cache of the application configured in inifile within its budget"""
+    config = ConfigParser.RawConfigParser()
+    config.read(inifile)
+    settings = {}
+    for section in config.sections():
+        for option in config.options(section):
+            settings[option] = config.get(section, option)
+    max_size = parse_size(settings.get('thumbnails.cache_max_size'))
+    if not max_size:
+        return
+    if settings.get('restrepo.repository_path'):
+        storage.REPO = settings['restrepo.repository_path']
+    evict(max_size)
+
+
+if __name__ == '__main__':
+    # usage: thumbnail_cache.py inifile
+    logging.basicConfig(level=logging.INFO)
+    evict_command(sys.argv[1])
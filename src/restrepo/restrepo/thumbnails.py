@@ -0,0 +1,372 @@
+#
+# copyright Gerbrandy SRL
+# www.gerbrandy.com
+# 2013
+#
+
+"""
+functions for creating resized (and watermarked) versions of scan images
+
+The functions in this module work on real filesystem paths and
+on a plain settings dictionary, so that they can be used both
+within a web request and from a celery worker (that has no pyramid registry).
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import types
+from PIL import Image
+from StringIO import StringIO
+
+from restrepo.storage import FILE_MODE
+
+# the name we use (in configuration files) for the original size of an image
+FULL_SIZE = 'full'
+
+# the NewSubfileType tag of a TIFF page, and its bit that marks the page
+# as a reduced-resolution version of another page
+NEW_SUBFILE_TYPE = 254
+REDUCED_RESOLUTION = 1
+
+# settings that determine how a derivative looks
+WATERMARK_SETTINGS = (
+    'watermark_file',
+    'watermark_size',
+    'watermark_pos_x',
+    'watermark_pos_y',
+    'watermark_image_format',
+)
+
+# decoded watermark images, keyed on the watermark settings (and the modification
+# time of the watermark file), and the versions of these scaled for a given image width
+_watermark_cache = {}
+_scaled_watermark_cache = {}
+_watermark_lock = threading.Lock()
+# we keep at most this many scaled watermarks in memory
+MAX_SCALED_WATERMARKS = 100
+
+
+def normalize_size(size):
+    """
+    Check the size argument, and return its canonical form
+
+    size is a string of the form INTxINT, where INT can be an
+    integer string or an empty string. A single integer is interpreted
+    as the maximal height.
+    None stands for the original size of the image.
+
+    >>> normalize_size('200')
+    'x200'
+    >>> normalize_size('100x')
+    '100x'
+    >>> normalize_size(None) is None
+    True
+    >>> normalize_size('x')
+    Traceback (most recent call last):
+    ...
+    ValueError: Size must be like 300x200 or x400 or 200x
+    """
+    if size is None:
+        return size
+    elif re.match('[0-9]+$', size):
+        return 'x' + size
+    elif re.match('([0-9]*)x([0-9]*)$', size) and size != 'x':
+        return size
+    else:
+        raise ValueError("Size must be like 300x200 or x400 or 200x")
+
+
+def get_pregenerated_sizes(settings):
+    """return the list of sizes that are rendered right after an upload
+
+    the sizes are read from the `thumbnails.pregenerate_sizes` setting,
+    a whitespace-separated list such as "x200 x800 full"
+
+    >>> get_pregenerated_sizes({'thumbnails.pregenerate_sizes': 'x200 800 full'})
+    ['x200', 'x800', None]
+    >>> get_pregenerated_sizes({})
+    []
+    """
+    result = []
+    for size in (settings.get('thumbnails.pregenerate_sizes') or '').split():
+        if size == FULL_SIZE:
+            result.append(None)
+        else:
+            result.append(normalize_size(size))
+    return result
+
+
+def get_watermark_settings(settings):
+    """return the subset of settings that is needed to render a derivative"""
+    return dict((key, settings.get(key)) for key in WATERMARK_SETTINGS)
+
+
+def get_settings_hash(watermark_settings):
+    """
+    Return a short string that identifies the watermark settings (and the watermark file)
+
+    This is part of the name of a cached thumbnail, so that when the settings change,
+    thumbnails rendered with the old settings are no longer used.
+    """
+    values = [watermark_settings.get(key) for key in WATERMARK_SETTINGS]
+    watermark_file = watermark_settings.get('watermark_file')
+    if watermark_file:
+        try:
+            values.append(os.path.getmtime(watermark_file))
+        except OSError:
+            pass
+    return hashlib.md5(repr(values)).hexdigest()[:8]
+
+
+def get_resized_size(newsize, oldsize):
+    """
+    newsize and oldsize are pairs of the form (width, height)
+    Given a target w and h return h, v so that their ratio is the same as
+    oldwidth, oldheight. width and height can be strings (also empty).
+    For example:
+
+    >>> get_resized_size(('100', ''), (1, 1))
+    (100, 100)
+    >>> get_resized_size(('', '100'), (1, 1))
+    (100, 100)
+    >>> get_resized_size(('', '100'), (1, 2))
+    (50, 100)
+    """
+    # If one of the parameters is missing calculate it using the ratio
+    # from old values
+    width, height = newsize
+    oldwidth, oldheight = oldsize
+    oldratio = oldwidth / float(oldheight)
+    if not width:
+        height = int(height)
+        width = height * oldratio
+    elif not height:
+        width = int(width)
+        height = width / oldratio
+    return int(width), int(height)
+
+
+def _watermark_key(settings):
+    watermark_file = settings['watermark_file']
+    try:
+        mtime = os.path.getmtime(watermark_file)
+    except OSError:
+        mtime = None
+    return tuple(settings.get(key) for key in WATERMARK_SETTINGS) + (mtime,)
+
+
+def _get_position(value, default=10):
+    if isinstance(value, types.StringTypes):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        return default
+    return value or 0
+
+
+def get_watermark_width(watermark_size, image_width):
+    """
+    Return the width in pixels of a watermark on an image that is image_width wide
+
+    watermark_size is a percentage of the image width or a number of pixels
+
+    >>> get_watermark_width('10%', 500)
+    50
+    >>> get_watermark_width('14', 500)
+    14
+    """
+    watermark_size = str(watermark_size).strip()
+    if watermark_size.endswith('%'):
+        return max(1, int(image_width * float(watermark_size[:-1]) / 100))
+    return max(1, int(watermark_size))
+
+
+def get_scaled_watermark(settings, image_size):
+    """
+    Return a tuple (watermark, (x, y)) where watermark is an RGBA image scaled for
+    an image of size image_size, and (x, y) is the position to paste it
+
+    Watermarks are decoded once per process and the scaled versions are cached,
+    so (apart from a stat call) no file is read for each thumbnail.
+    """
+    key = _watermark_key(settings)
+    width = get_watermark_width(settings.get('watermark_size') or '4%', image_size[0])
+    with _watermark_lock:
+        scaled = _scaled_watermark_cache.get((key, width))
+        if scaled is None:
+            original = _watermark_cache.get(key)
+            if original is None:
+                original = Image.open(settings['watermark_file'])
+                if original.mode != 'RGBA':
+                    original = original.convert('RGBA')
+                original.load()
+                _watermark_cache[key] = original
+            height = max(1, int(original.size[1] * width / float(original.size[0])))
+            scaled = original.resize((width, height), Image.ANTIALIAS)
+            if len(_scaled_watermark_cache) >= MAX_SCALED_WATERMARKS:
+                _scaled_watermark_cache.clear()
+            _scaled_watermark_cache[(key, width)] = scaled
+    x = image_size[0] - scaled.size[0] - _get_position(settings.get('watermark_pos_x'))
+    y = image_size[1] - scaled.size[1] - _get_position(settings.get('watermark_pos_y'))
+    return scaled, (x, y)
+
+
+def invalidate_watermark_cache():
+    """forget all cached watermarks (for example, after the settings are changed)"""
+    with _watermark_lock:
+        _watermark_cache.clear()
+        _scaled_watermark_cache.clear()
+
+
+def _is_reduced_version(img, full_size):
+    """
+    True if the current page of the tiff image img is a reduced-resolution
+    version of a page of full_size: it must say so in its NewSubfileType tag,
+    and have the same proportions (up to rounding)
+    """
+    new_subfile_type = img.tag.get(NEW_SUBFILE_TYPE, 0)
+    if isinstance(new_subfile_type, tuple):
+        new_subfile_type = new_subfile_type and new_subfile_type[0] or 0
+    if not new_subfile_type & REDUCED_RESOLUTION:
+        return False
+    width, height = img.size
+    return abs(width * full_size[1] - height * full_size[0]) <= full_size[0] + full_size[1]
+
+
+def reduce_for_size(img, size):
+    """
+    Return a version of img (which is opened but not yet loaded) that is
+    as small as possible while still being at least size = (width, height)
+
+    For pyramidal TIFF files we select the smallest reduced-resolution page
+    that is still large enough, so the full raster of the original is never decoded.
+    Other pages of multi-page TIFF files may have other content, and are not used.
+    (JPEG files are decoded at reduced resolution by Image.thumbnail, which
+    puts the decoder in draft mode; calling draft twice is not safe)
+    """
+    if img.format == 'TIFF':
+        full_size = img.size
+        best_frame = 0
+        best_size = full_size
+        frame = 0
+        while True:
+            frame += 1
+            try:
+                img.seek(frame)
+            except EOFError:
+                break
+            if (size[0] <= img.size[0] < best_size[0] and
+                    size[1] <= img.size[1] < best_size[1] and
+                    _is_reduced_version(img, full_size)):
+                best_frame = frame
+                best_size = img.size
+        img.seek(best_frame)
+    return img
+
+
+def render_thumbnail(original_path, thumbnail_path, size, settings):
+    """
+    Create a resized, watermarked version of the image at original_path
+    and save it at thumbnail_path
+
+    size must be normalized (cf. normalize_size)
+    settings is a dictionary with (at least) the watermark settings
+    """
+    fh = open(original_path, 'rb')
+    img = Image.open(fh)
+    if not size:
+        size = '100000x10000'
+    w, h = get_resized_size(size.split('x'), img.size)
+    if w >= img.size[0]:
+        # we asked for an image larger than the original - we return the original instead
+        w, h = img.size
+    img = reduce_for_size(img, (w, h))
+    img.thumbnail((w, h), Image.ANTIALIAS)
+    if img.mode == "P":
+        img = img.convert("RGB")
+
+    # determine if we need to watermark this file
+    if w > 100 and h > 100 and settings.get('watermark_file'):
+        watermark, (x, y) = get_scaled_watermark(settings, img.size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.paste(watermark, (x, y), watermark)
+        image_format = settings.get('watermark_image_format') or 'jpeg'
+    else:
+        image_format = 'JPEG'
+
+    save_fh = StringIO()
+    img.save(save_fh, image_format.upper(), **img.info)
+    fh.close()
+
+    # write to a temporary file and rename it, so readers never see a half-written file
+    dirname, basename = os.path.split(thumbnail_path)
+    _makedirs(dirname)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.%s.' % basename)
+    try:
+        with os.fdopen(tmp_fd, 'wb') as out:
+            out.write(save_fh.getvalue())
+        os.chmod(tmp_path, FILE_MODE)
+        os.rename(tmp_path, thumbnail_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    save_fh.close()
+    return thumbnail_path
+
+
+def ensure_thumbnail(original_path, thumbnail_path, size, settings):
+    """
+    Render the thumbnail at thumbnail_path, unless it exists already
+
+    Concurrent calls for the same thumbnail (from other threads or from other
+    processes, such as celery workers) are coordinated with a lock file next to
+    the thumbnail: one caller renders the image, the others wait for it and
+    then use the result.
+    """
+    if os.path.isfile(thumbnail_path):
+        return thumbnail_path
+    _makedirs(os.path.dirname(thumbnail_path))
+    lock_path = thumbnail_path + '.lock'
+    while True:
+        # flock locks belong to the open file, so this also excludes other threads in this process
+        with open(lock_path, 'a') as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                if not _is_lock_file(lock_fh, lock_path):
+                    # the file we locked was removed by the caller that held the lock before us,
+                    # and new callers lock a new file at lock_path: so we must lock that one too
+                    continue
+                if not os.path.isfile(thumbnail_path):
+                    render_thumbnail(original_path, thumbnail_path, size, settings)
+            finally:
+                if _is_lock_file(lock_fh, lock_path):
+                    # we remove the lock file while we hold the lock, so callers
+                    # that wait for it will see it was removed (cf. above)
+                    os.unlink(lock_path)
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+        return thumbnail_path
+
+
+def _is_lock_file(lock_fh, lock_path):
+    """True if the open file lock_fh is (still) the file at lock_path"""
+    try:
+        stat = os.stat(lock_path)
+    except OSError:
+        return False
+    fstat = os.fstat(lock_fh.fileno())
+    return (stat.st_dev, stat.st_ino) == (fstat.st_dev, fstat.st_ino)
+
+
+def _makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError, error:
+        if error.errno != errno.EEXIST:
+            raise
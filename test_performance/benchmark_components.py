@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compare the cost of computing the parents and breadcrumbs of the components of
+an EAD file by walking back through all previous components (as we used to do)
+with the cost of walking up through the ancestors of the previous component
+(cf. restrepo.db.eadcomponent.EadComponent._find_parent)
+
+usage:
+
+    python benchmark_components.py [--copies 5] [eadfile]
+
+Without an eadfile argument, the largest EAD file in
+src/restrepo/restrepo/tests/test_files is used. To get something closer to a
+large finding aid, the top level components are copied `copies` times (default 5).
+
+No database or solr is needed: the data that the components normally get from
+these is filled in with dummy values.
+"""
+import copy
+import glob
+import json
+import os
+import sys
+import time
+
+from lxml import etree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src', 'restrepo'))
+TEST_FILES = os.path.join(HERE, '..', 'src', 'restrepo', 'restrepo', 'tests', 'test_files')
+
+from restrepo.db.ead import c_node_selector  # @IgnorePep8
+from restrepo.db.eadcomponent import EadComponent  # @IgnorePep8
+
+
+class DummyEadFile(object):
+    _cache = {
+        'archive': 'archive',
+        'archive_id': 1,
+        'country': 'NL',
+        'ead_id': 'benchmark.xml',
+        'findingaid': 'findingaid',
+        'institution': 'institution',
+        'language': 'en',
+    }
+    # no scans, and no archive files in the database
+    _archivefile_data = ({}, {})
+
+
+class WalkingEadComponent(EadComponent):
+    """the components as they were: walk back through all previous components to find the parent"""
+
+    def _find_parent(self, prev):
+        return None
+
+    def get_parent(self):
+        node = self.prev
+        while node:
+            if self._xpath_contained_in(self.xpath, node.xpath):
+                return node
+            node = node.prev
+
+    @property
+    def breadcrumbs(self):
+        current_node = self.get_parent()
+        breadcrumbs = []
+        while current_node:
+            if current_node.show_in_tree:
+                breadcrumbs.append(current_node)
+            current_node = current_node.get_parent()
+        breadcrumbs = [[x.xpath, x.title] for x in breadcrumbs]
+        return unicode(json.dumps(breadcrumbs))
+
+
+def enlarge(tree, copies):
+    """copy the top level components of the tree `copies` times"""
+    top_level = [el for el in tree.xpath(c_node_selector) if el.getparent().tag == 'dsc']
+    for _i in range(copies - 1):
+        for el in top_level:
+            el.getparent().append(copy.deepcopy(el))
+    return tree
+
+
+def extract(tree, cls):
+    """create the components, and compute what get_solr_data needs of the tree structure"""
+    ead_file = DummyEadFile()
+    components = []
+    prev = None
+    for i, element in enumerate(tree.xpath(c_node_selector)):
+        component = cls(element=element, ead_file=ead_file, prev=prev, sequenceNumber=i)
+        components.append(component)
+        prev = component
+    return [(c.parent, c.breadcrumbs, c.is_rootlevel, c.show_in_tree) for c in components]
+
+
+def measure(tree, cls):
+    start = time.time()
+    result = extract(tree, cls)
+    return time.time() - start, result
+
+
+def main(argv):
+    copies = 5
+    path = None
+    while argv:
+        arg = argv.pop(0)
+        if arg == '--copies':
+            copies = int(argv.pop(0))
+        else:
+            path = arg
+    if path is None:
+        path = max(glob.glob(os.path.join(TEST_FILES, '*.xml')), key=os.path.getsize)
+
+    tree = enlarge(etree.parse(path), copies)
+    print '%s: %i components' % (os.path.basename(path), len(tree.xpath(c_node_selector)))
+    walking, walking_result = measure(tree, WalkingEadComponent)
+    stack, stack_result = measure(tree, EadComponent)
+    assert walking_result == stack_result, 'the results differ'
+    print '%-30s %8.3f seconds' % ('walk back through components', walking)
+    print '%-30s %8.3f seconds' % ('walk up through ancestors', stack)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
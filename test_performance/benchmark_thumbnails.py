@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Compare the cost of rendering a thumbnail by decoding the full image
+with the cost of rendering it with reduced-resolution decoding
+(cf. restrepo.thumbnails.reduce_for_size)
+
+usage:
+
+    python benchmark_thumbnails.py [--size x200] [--scale 10] [image ...]
+
+Without image arguments, the jpg and tif images in
+src/restrepo/restrepo/tests/test_files are used. As these are small, they
+are first enlarged `scale` times (default 10) to get something closer
+to a 300dpi scan, and saved as a jpeg file and as a pyramidal tiff file
+(with reduced-resolution pages of 1/2, 1/4 and 1/8 of the size).
+
+The pyramidal tiff files are written by write_tiff, because the version
+of PIL we use cannot write multi-page tiff files.
+
+Each measurement runs in a separate process, so that the reported peak
+memory (max rss) belongs to that measurement only.
+"""
+import glob
+import os
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src', 'restrepo'))
+TEST_FILES = os.path.join(HERE, '..', 'src', 'restrepo', 'restrepo', 'tests', 'test_files')
+
+from PIL import Image  # @IgnorePep8
+from restrepo.thumbnails import get_resized_size, reduce_for_size  # @IgnorePep8
+
+REPEAT = 5
+
+
+def render(path, size, reduced):
+    img = Image.open(path)
+    w, h = get_resized_size(size.split('x'), img.size)
+    if reduced:
+        img = reduce_for_size(img, (w, h))
+    else:
+        # decode the full raster (this also keeps thumbnail from using draft mode)
+        img.load()
+    img.thumbnail((w, h), Image.ANTIALIAS)
+    return img
+
+
+def measure(path, size, reduced):
+    """render REPEAT times, print seconds per thumbnail and max rss in KB"""
+    start = time.time()
+    for _i in range(REPEAT):
+        render(path, size, reduced)
+    elapsed = (time.time() - start) / REPEAT
+    print elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_measurement(path, size, reduced):
+    output = subprocess.check_output([
+        sys.executable, __file__, '--measure', path, size, reduced and '1' or '0',
+    ])
+    elapsed, maxrss = output.split()
+    return float(elapsed), int(maxrss)
+
+
+# values of the NewSubfileType tag of a tiff page
+FULL_RESOLUTION = 0
+REDUCED_RESOLUTION = 1
+
+
+def write_tiff(path, pages):
+    """
+    write an uncompressed RGB tiff file
+
+    pages is a list of (image, new_subfile_type) tuples, where new_subfile_type is
+    REDUCED_RESOLUTION for pages that are smaller versions of the first page
+    """
+    with open(path, 'wb') as fh:
+        # the header: byte order, magic number, and (filled in below) the offset of the first page
+        fh.write(struct.pack('<2sHI', 'II', 42, 0))
+        next_offset_position = 4
+        for img, new_subfile_type in pages:
+            img = img.convert('RGB')
+            width, height = img.size
+            data = img.tobytes()
+            data_offset = fh.tell()
+            fh.write(data)
+            bits_per_sample_offset = fh.tell()
+            fh.write(struct.pack('<3H', 8, 8, 8))
+            # the directory of the page, which must start on a word boundary
+            if fh.tell() % 2:
+                fh.write('\0')
+            directory_offset = fh.tell()
+            entries = [
+                # (tag, type (3 is SHORT, 4 is LONG), count, value)
+                (254, 4, 1, new_subfile_type),
+                (256, 4, 1, width),
+                (257, 4, 1, height),
+                (258, 3, 3, bits_per_sample_offset),
+                (259, 3, 1, 1),  # no compression
+                (262, 3, 1, 2),  # RGB
+                (273, 4, 1, data_offset),
+                (277, 3, 1, 3),  # samples per pixel
+                (278, 4, 1, height),  # rows per strip
+                (279, 4, 1, len(data)),
+                (284, 3, 1, 1),  # chunky planar configuration
+            ]
+            fh.write(struct.pack('<H', len(entries)))
+            for tag, tag_type, count, value in entries:
+                if tag_type == 3 and count == 1:
+                    fh.write(struct.pack('<HHIHH', tag, tag_type, count, value, 0))
+                else:
+                    fh.write(struct.pack('<HHII', tag, tag_type, count, value))
+            end_of_directory = fh.tell()
+            fh.write(struct.pack('<I', 0))
+            # link the previous page (or the header) to this one
+            fh.seek(next_offset_position)
+            fh.write(struct.pack('<I', directory_offset))
+            fh.seek(0, os.SEEK_END)
+            next_offset_position = end_of_directory
+
+
+def enlarge(paths, scale, tmpdir):
+    result = []
+    for path in paths:
+        img = Image.open(path)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img = img.resize((img.size[0] * scale, img.size[1] * scale), Image.BICUBIC)
+        basename = os.path.join(tmpdir, os.path.splitext(os.path.basename(path))[0])
+        img.save(basename + '.jpg', 'JPEG')
+        result.append(basename + '.jpg')
+        # a pyramidal tiff, with pages of 1, 1/2, 1/4 and 1/8 of the size
+        pages = [(img, FULL_RESOLUTION)] + [
+            (img.resize((img.size[0] / f, img.size[1] / f), Image.BICUBIC), REDUCED_RESOLUTION) for f in (2, 4, 8)]
+        write_tiff(basename + '.tif', pages)
+        result.append(basename + '.tif')
+    return result
+
+
+def is_single_page(path):
+    img = Image.open(path)
+    try:
+        img.seek(1)
+    except EOFError:
+        return True
+    return False
+
+
+def main(argv):
+    size = 'x200'
+    scale = 10
+    paths = []
+    while argv:
+        arg = argv.pop(0)
+        if arg == '--size':
+            size = argv.pop(0)
+        elif arg == '--scale':
+            scale = int(argv.pop(0))
+        else:
+            paths.append(arg)
+
+    tmpdir = None
+    if not paths:
+        originals = [fn for fn in glob.glob(os.path.join(TEST_FILES, '*.jpg')) + glob.glob(os.path.join(TEST_FILES, '*.tif'))
+            if min(Image.open(fn).size) > 10 and is_single_page(fn)]
+        tmpdir = tempfile.mkdtemp()
+        paths = enlarge(originals, scale, tmpdir)
+
+    try:
+        print '%-30s %12s %8s %12s %8s' % ('image', 'full (s)', 'KB', 'reduced (s)', 'KB')
+        for path in paths:
+            full = run_measurement(path, size, False)
+            reduced = run_measurement(path, size, True)
+            print '%-30s %12.4f %8i %12.4f %8i' % ((os.path.basename(path),) + full + reduced)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], sys.argv[3], sys.argv[4] == '1')
+    else:
+        main(sys.argv[1:])